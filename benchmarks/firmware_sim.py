@@ -0,0 +1,283 @@
+"""Simulador de CNC_code.ino sobre un pseudo-terminal.
+
+Reproduce lo que ve el host al hablar con el plotter:
+- el mensaje de arranque de setup() tras el reinicio,
+- el buffer de recepción de 64 bytes del Arduino (lo que llega con el
+  buffer lleno se pierde) alimentado al ritmo real del puerto (8N1),
+- el lector de loop(): descarta espacios, comentarios ( ) y ;, pasa a
+  mayúsculas, desborda a los 1024 caracteres y contesta "ok" por cada
+  \\n o \\r (también en líneas vacías),
+- processIncomingLine(): G0/G1 con X/Y, M300 S30/S50, M114 y "Command not
+  recognized" para el resto de M, con las mismas rarezas (una U o una D en
+  cualquier parte de la línea mueve la pluma, G lee un solo dígito),
+- el tiempo de ejecución de drawLine() y del servo (ver gcode_estimate),
+  multiplicado por time_scale o sustituido por un tiempo fijo por comando.
+
+Uso (solo Linux/macOS):
+    python benchmarks/firmware_sim.py [--time-scale 1] [--boot 0]
+y conectar el controlador al pseudo-terminal que se indica.
+"""
+import argparse
+import os
+import pty
+import re
+import sys
+import threading
+import time
+import tty
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from gcode_estimate import FIRMWARE_SETTINGS
+
+LINE_BUFFER_LENGTH = 1024
+RX_BUFFER = 64
+
+BANNER = ("Mini CNC Plotter alive and kicking!\r\n"
+          "X range is from {Xmin:.2f} to {Xmax:.2f} mm.\r\n"
+          "Y range is from {Ymin:.2f} to {Ymax:.2f} mm.\r\n")
+
+_FLOAT_RE = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_INT_RE = re.compile(r'[-+]?\d+')
+
+
+def _atof(text):
+    match = _FLOAT_RE.match(text)
+    return float(match.group()) if match else 0.0
+
+
+def _atoi(text):
+    match = _INT_RE.match(text)
+    return int(match.group()) if match else 0
+
+
+class FirmwareSimulator:
+    """CNC_code.ino en un hilo, detrás del extremo maestro de un pseudo-terminal.
+
+    delays: tiempo fijo (s) por comando ('G0', 'G1', 'M300', 'M114', 'M') que
+    sustituye al modelo; time_scale escala el tiempo modelado (0 = instantáneo).
+    """
+
+    def __init__(self, time_scale=1.0, boot_time=0.0, delays=None, rx_buffer=RX_BUFFER, **settings):
+        self.config = dict(FIRMWARE_SETTINGS, **settings)
+        self.time_scale = time_scale
+        self.boot_time = boot_time
+        self.delays = delays or {}
+        self.rx_buffer = rx_buffer
+        self.byte_time = 10.0 / self.config['baud']
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self._rx = deque()
+        self._rx_ready = threading.Condition()
+        self._tx = deque()
+        self._tx_ready = threading.Condition()
+        self._running = False
+        self.reset_counters()
+        # Estado del firmware
+        self.actuator = [0.0, 0.0]  # actuatorPos (mm)
+        self.steps = [0, 0]         # Xpos/Ypos (pasos)
+        self.pen_down = False
+
+    def reset_counters(self):
+        self.lines = 0            # Líneas ejecutadas
+        self.oks = 0
+        self.dropped = 0          # Bytes perdidos por buffer RX lleno
+        self.max_rx = 0           # Ocupación máxima del buffer RX
+        self.busy_time = 0.0      # Tiempo ejecutando comandos
+
+    def start(self):
+        self._running = True
+        self._booted = time.perf_counter() + self.boot_time
+        threading.Thread(target=self._wire, daemon=True).start()
+        threading.Thread(target=self._transmit, daemon=True).start()
+        threading.Thread(target=self._loop, daemon=True).start()
+        return self
+
+    def close(self):
+        self._running = False
+        for ready in (self._rx_ready, self._tx_ready):
+            with ready:
+                ready.notify_all()
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    # Puerto serie: los bytes llegan al buffer RX al ritmo del baudrate
+    def _wire(self):
+        arrival = 0.0
+        while self._running:
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                return
+            for byte in data:
+                now = time.perf_counter()
+                arrival = max(arrival, now) + self.byte_time
+                if arrival > now:
+                    time.sleep(arrival - now)
+                if arrival < self._booted:
+                    continue  # El bootloader no pasa nada al sketch
+                with self._rx_ready:
+                    if len(self._rx) >= self.rx_buffer:
+                        self.dropped += 1
+                        continue
+                    self._rx.append(byte)
+                    self.max_rx = max(self.max_rx, len(self._rx))
+                    self._rx_ready.notify()
+
+    def _read(self):
+        with self._rx_ready:
+            while self._running and not self._rx:
+                self._rx_ready.wait(0.1)
+            return self._rx.popleft() if self._rx else None
+
+    def _print(self, text):
+        """Serial.print: no bloquea, los bytes salen al ritmo del baudrate"""
+        with self._tx_ready:
+            self._tx.append(text.encode())
+            self._tx_ready.notify()
+
+    def _transmit(self):
+        sent = 0.0
+        while self._running:
+            with self._tx_ready:
+                while self._running and not self._tx:
+                    self._tx_ready.wait(0.1)
+                if not self._tx:
+                    continue
+                data = self._tx.popleft()
+            sent = max(sent, time.perf_counter()) + len(data) * self.byte_time
+            delay = sent - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                os.write(self.master, data)
+            except OSError:
+                return
+
+    def _busy(self, seconds):
+        if seconds > 0:
+            self.busy_time += seconds
+            time.sleep(seconds)
+
+    # loop()
+    def _loop(self):
+        delay = self._booted - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self._print(BANNER.format(**self.config))
+        time.sleep(0.1)  # delay(100) al entrar en loop()
+        line = []
+        comment = semicolon = False
+        while self._running:
+            c = self._read()
+            if c is None:
+                continue
+            c = chr(c)
+            if c in '\n\r':
+                if line:
+                    self.process_line(''.join(line))
+                    line = []
+                comment = semicolon = False
+                self.oks += 1
+                self._print("ok\r\n")
+            elif comment or semicolon:
+                if c == ')':
+                    comment = False
+            elif c <= ' ' or c >= '\x80' or c == '/':
+                pass  # c es char con signo: los bytes >= 0x80 también son <= ' '
+            elif c == '(':
+                comment = True
+            elif c == ';':
+                semicolon = True
+            elif len(line) >= LINE_BUFFER_LENGTH - 1:
+                self._print("ERROR - lineBuffer overflow\r\n")
+                comment = semicolon = False
+            else:
+                line.append(c.upper())
+
+    # processIncomingLine()
+    def process_line(self, line):
+        self.lines += 1
+        index = 0
+        while index < len(line):
+            c = line[index]
+            index += 1
+            if c == 'U':
+                self.pen(False, 'M300')
+            elif c == 'D':
+                self.pen(True, 'M300')
+            elif c == 'G':
+                code = _atoi(line[index:index + 1])
+                index += 1
+                if code in (0, 1):
+                    rest = line[index:]
+                    ix, iy = rest.find('X'), rest.find('Y')
+                    x, y = self.actuator
+                    if ix >= 0:
+                        x = _atof(rest[ix + 1:])
+                    if iy >= 0:
+                        y = _atof(rest[iy + 1:])
+                    self.draw_line(x, y, f"G{code}")
+                    self.actuator = [x, y]
+            elif c == 'M':
+                buffer = line[index:index + 3]
+                index += 3
+                code = _atoi(buffer)
+                if code == 300:
+                    s = line.find('S', index)
+                    spos = _atof(line[s + 1:]) if s >= 0 else 0.0
+                    if spos == 30:
+                        self.pen(True, 'M300')
+                    if spos == 50:
+                        self.pen(False, 'M300')
+                elif code == 114:
+                    self._print(f"Absolute position : X = {self.actuator[0]:.2f}  -  "
+                                f"Y = {self.actuator[1]:.2f}\r\n")
+                    self._busy(self.delays.get('M114', 0.0))
+                else:
+                    self._print(f"Command not recognized : M{buffer}\r\n")
+                    self._busy(self.delays.get('M', 0.0))
+
+    def draw_line(self, x, y, command):
+        config = self.config
+        x = min(max(x, config['Xmin']), config['Xmax'])
+        y = min(max(y, config['Ymin']), config['Ymax'])
+        target = [int(x * config['StepsPerMillimeterX']), int(y * config['StepsPerMillimeterY'])]
+        dx = abs(target[0] - self.steps[0])
+        dy = abs(target[1] - self.steps[1])
+        self.steps = target
+        if command in self.delays:
+            self._busy(self.delays[command])
+        else:
+            self._busy(self.time_scale * ((dx + dy) * config['step_time']
+                                          + max(dx, dy) * config['StepDelay'] / 1000.0
+                                          + config['LineDelay'] / 1000.0))
+
+    def pen(self, down, command):
+        self.pen_down = down
+        self._busy(self.delays.get(command, self.time_scale * self.config['penDelay'] / 1000.0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simula CNC_code.ino en un pseudo-terminal")
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help="factor del tiempo de ejecución (0 = instantáneo)")
+    parser.add_argument('--boot', type=float, default=0.0, help="duración del arranque (s)")
+    args = parser.parse_args(argv)
+    simulator = FirmwareSimulator(time_scale=args.time_scale, boot_time=args.boot).start()
+    print(f"Simulador de CNC_code.ino en {simulator.port} (Ctrl+C para salir)", flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.close()
+        print(f"{simulator.lines} líneas ejecutadas, {simulator.dropped} bytes perdidos")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Compara la latencia de los "ok" entre el lector por eventos de GCodeController
+y el antiguo bucle que consultaba in_waiting cada 10 ms.
+
+Un dispositivo falso sobre un pseudo-terminal envía "ok" a intervalos
+aleatorios y se mide el tiempo hasta que el controlador lo procesa.
+
+Uso (solo Linux/macOS):
+    python benchmarks/reader_latency.py [muestras]
+"""
+import os
+import pty
+import random
+import statistics
+import sys
+import threading
+import time
+import tty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from gcode_controller import GCodeController
+
+
+class PollingController(GCodeController):
+    """Controlador con el lector anterior (in_waiting + readline + sleep de 10 ms)"""
+
+    def read_responses(self):
+        while self.running and self.port and self.port.is_open:
+            try:
+                if self.port.in_waiting > 0:
+                    response = self.port.readline().decode().strip()
+                    if response:
+                        self.process_response(response)
+            except Exception:
+                break
+            time.sleep(0.01)
+
+
+def measure(controller_class, samples):
+    """Devuelve las latencias (s) entre la escritura de cada "ok" y su procesado"""
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    controller = controller_class()
+    received = []
+    sent = []
+    arrived = threading.Event()
+
+    def on_ok():
+        received.append(time.perf_counter())
+        arrived.set()
+
+    controller.handle_ok = on_ok
+    controller.connect(os.ttyname(slave))
+    time.sleep(0.2)
+    try:
+        for _ in range(samples):
+            time.sleep(random.uniform(0.002, 0.02))
+            arrived.clear()
+            sent.append(time.perf_counter())
+            os.write(master, b"ok\r\n")
+            arrived.wait(1)
+    finally:
+        controller.disconnect()
+        os.close(master)
+        os.close(slave)
+    return [r - s for s, r in zip(sent, received)]
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:<16} n={len(latencies):4d}  "
+          f"media={statistics.mean(latencies) * 1000:6.2f} ms  "
+          f"p50={statistics.median(latencies) * 1000:6.2f} ms  "
+          f"p99={p99 * 1000:6.2f} ms")
+
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    report("sondeo 10 ms", measure(PollingController, samples))
+    report("por eventos", measure(GCodeController, samples))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Benchmark de streaming contra el simulador del firmware (firmware_sim.py).
+
+Envía los archivos de Gcodes/ con GCodeController en cada protocolo y mide
+el tiempo total, las líneas por segundo y la latencia hasta el "ok"
+(p50/p99). También comprueba que el buffer RX simulado no pierde bytes.
+Los resultados se pueden guardar en JSON para comparar cambios en el
+protocolo o en el procesado.
+
+El modo ping-pong espera 0,2 s por línea: por defecto solo se envían las
+primeras --max-lines líneas de cada archivo (0 = completos).
+
+Uso (solo Linux/macOS):
+    python benchmarks/streaming.py [--mode char-count] [--max-lines 50]
+                                   [--time-scale 1] [--json resultados.json] [archivos...]
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, ".."))
+
+from firmware_sim import FirmwareSimulator
+from gcode_controller import GCodeController, STREAM_MODES
+
+GCODES = os.path.join(BENCHMARKS, "..", "Gcodes")
+
+# Tiempo máximo por archivo antes de darlo por atascado
+FILE_TIMEOUT = 3600
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else float('nan')
+
+
+def run_mode(mode, files, args):
+    """Envía todos los archivos con un protocolo; devuelve una fila por archivo"""
+    simulator = FirmwareSimulator(time_scale=args.time_scale).start()
+    controller = GCodeController(stream_mode=mode)
+    controller.compact_wire = args.compact
+    controller.reorder_polylines = args.reorder
+    finished = threading.Event()
+    controller.set_finished_callback(finished.set)
+    controller.connect(simulator.port)
+    time.sleep(0.3)  # Mensaje de arranque y delay(100) de loop()
+    rows = []
+    try:
+        for filename in files:
+            if not controller.load_gcode(filename, lazy=False):
+                continue
+            if args.max_lines:
+                controller.gcode = controller.gcode[:args.max_lines]
+            if not controller.gcode:
+                continue
+            simulator.reset_counters()
+            finished.clear()
+            started = time.perf_counter()
+            controller.start_streaming()
+            completed = finished.wait(FILE_TIMEOUT)
+            wall = time.perf_counter() - started
+            if not completed:
+                controller.stop_streaming()
+            latency = [row['latency'] for row in controller.telemetry.trace()
+                       if row['latency'] is not None]
+            lines = len(controller.gcode)
+            rows.append({
+                'mode': mode,
+                'file': os.path.basename(filename),
+                'lines': lines,
+                'completed': completed,
+                'wall': wall,
+                'lines_per_s': lines / wall,
+                'latency': latency,
+                'latency_p50': percentile(latency, 50),
+                'latency_p99': percentile(latency, 99),
+                'bytes': controller.telemetry.stats()['bytes_sent'],
+                'busy': simulator.busy_time,
+                'dropped': simulator.dropped,
+                'max_rx': simulator.max_rx,
+            })
+            print_row(rows[-1])
+    finally:
+        controller.disconnect()
+        simulator.close()
+    return rows
+
+
+def print_row(row):
+    status = "" if row['completed'] else "  ¡SIN TERMINAR!"
+    print(f"{row['mode']:<11} {row['file'][:24]:<24} {row['lines']:>6} {row['wall']:>8.2f} "
+          f"{row['lines_per_s']:>8.1f} {row['latency_p50'] * 1000:>8.1f} "
+          f"{row['latency_p99'] * 1000:>8.1f} {row['busy']:>8.2f} {row['max_rx']:>4} "
+          f"{row['dropped']:>5}{status}", flush=True)
+
+
+def summarize(rows):
+    """Totales por protocolo"""
+    summary = {}
+    for mode in dict.fromkeys(row['mode'] for row in rows):
+        selected = [row for row in rows if row['mode'] == mode]
+        latency = [value for row in selected for value in row['latency']]
+        lines = sum(row['lines'] for row in selected)
+        wall = sum(row['wall'] for row in selected)
+        summary[mode] = {
+            'files': len(selected),
+            'lines': lines,
+            'wall': wall,
+            'lines_per_s': lines / wall if wall else 0.0,
+            'latency_p50': percentile(latency, 50),
+            'latency_p99': percentile(latency, 99),
+            'busy': sum(row['busy'] for row in selected),
+            'dropped': sum(row['dropped'] for row in selected),
+            'incomplete': sum(not row['completed'] for row in selected),
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de streaming contra el simulador del firmware")
+    parser.add_argument('paths', nargs='*', help="archivos .gcode (por defecto Gcodes/*.gcode)")
+    parser.add_argument('--mode', choices=STREAM_MODES, action='append',
+                        help="protocolo (repetible; por defecto todos)")
+    parser.add_argument('--max-lines', type=int, default=50,
+                        help="líneas por archivo (0 = archivo completo)")
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help="factor del tiempo de ejecución del firmware (0 = instantáneo)")
+    parser.add_argument('--compact', action='store_true', help="compactar comandos")
+    parser.add_argument('--reorder', action='store_true', help="optimizar recorridos")
+    parser.add_argument('--json', help="guardar los resultados en este archivo")
+    args = parser.parse_args(argv)
+
+    files = args.paths or sorted(glob.glob(os.path.join(GCODES, '*.gcode')))
+    modes = args.mode or list(STREAM_MODES)
+
+    print(f"{'modo':<11} {'archivo':<24} {'líneas':>6} {'total s':>8} {'líneas/s':>8} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'máq. s':>8} {'rx':>4} {'perd.':>5}")
+    rows = []
+    for mode in modes:
+        rows.extend(run_mode(mode, files, args))
+    summary = summarize(rows)
+    print()
+    for mode, total in summary.items():
+        print(f"{mode:<11} {total['files']} archivos, {total['lines']} líneas en {total['wall']:.1f} s: "
+              f"{total['lines_per_s']:.1f} líneas/s, latencia p50 {total['latency_p50'] * 1000:.1f} ms, "
+              f"p99 {total['latency_p99'] * 1000:.1f} ms, máquina ocupada {total['busy']:.1f} s, "
+              f"{total['dropped']} bytes perdidos")
+    if args.json:
+        settings = {key: value for key, value in vars(args).items() if key != 'json'}
+        for row in rows:
+            del row['latency']
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'settings': settings, 'summary': summary, 'files': rows}, f, indent=1)
+    return 1 if any(total['dropped'] or total['incomplete'] for total in summary.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""Caché en disco de programas compilados y procesados.
+
+La clave de cada entrada es el SHA-256 del contenido del archivo junto con
+los ajustes de procesado (optimización, simplificación, compactación) y
+los parámetros del estimador: si cambia el archivo o cualquier ajuste, la
+clave es otra y la entrada antigua deja de usarse hasta que la expulsa el
+LRU. Cada entrada es un .npz sin comprimir con las columnas del programa,
+las líneas no compiladas y un JSON con los metadatos y las estimaciones.
+
+El tamaño total se limita a max_bytes: al leer una entrada se actualiza
+su fecha de modificación y al guardar se borran las menos usadas.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+from gcode_estimate import FIRMWARE_SETTINGS
+from gcode_program import GCodeProgram
+
+# Cambiar cuando cambie el formato de las entradas o la compilación
+CACHE_VERSION = 1
+
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+HASH_CHUNK = 1024 * 1024
+
+
+def default_cache_dir():
+    """Directorio de caché del usuario según el sistema"""
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'gctrl')
+
+
+def atomic_write(path, write, binary=True):
+    """Escribe un archivo con write(f) en un temporal y lo renombra
+
+    Quien lea path nunca ve un archivo a medias: o el anterior o el nuevo.
+    """
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with (os.fdopen(fd, 'wb') if binary else os.fdopen(fd, 'w', encoding='utf-8')) as f:
+            write(f)
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+
+
+def file_digest(filename):
+    """SHA-256 del contenido de un archivo"""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ProgramCache:
+    """Programas procesados guardados en disco por contenido y ajustes"""
+
+    def __init__(self, directory=None, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self._digests = {}  # (ruta, tamaño, mtime) -> SHA-256, para no releer archivos sin cambios
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, filename, settings):
+        """Clave de un archivo procesado con unos ajustes"""
+        stat = os.stat(filename)
+        stamp = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+        digest = self._digests.get(stamp)
+        if digest is None:
+            digest = self._digests[stamp] = file_digest(filename)
+        identity = json.dumps({'version': CACHE_VERSION, 'file': digest, 'settings': settings,
+                               'firmware': FIRMWARE_SETTINGS}, sort_keys=True)
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def load(self, key):
+        """Devuelve (programa, metadatos) o None si no está en la caché"""
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                data = entry['data']
+                emit = entry['emit'] if entry['has_emit'] else None
+                raw = dict(zip(entry['raw_rows'].tolist(), entry['raw_text'].tolist()))
+                meta = json.loads(str(entry['meta']))
+            os.utime(path)  # Usada ahora: la última en salir del LRU
+        except OSError:
+            return None  # No existe o no se puede leer
+        except (zipfile.BadZipFile, EOFError, KeyError, ValueError):
+            # Truncada o dañada: se borra para que se vuelva a generar
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return GCodeProgram(data, raw, meta['decimals'], emit), meta
+
+    def store(self, key, program, meta):
+        """Guarda un programa con sus metadatos y aplica el límite de tamaño"""
+        meta = dict(meta, decimals=program.decimals)
+        rows = sorted(program.raw)
+        arrays = {
+            'data': program.data,
+            'has_emit': np.array(program.emit is not None),
+            'emit': program.emit if program.emit is not None else np.zeros(0, dtype=np.uint8),
+            'raw_rows': np.array(rows, dtype=np.int64),
+            'raw_text': np.array([program.raw[row] for row in rows], dtype=str),
+            'meta': np.array(json.dumps(meta)),
+        }
+        atomic_write(self._path(key), lambda f: np.savez(f, **arrays))
+        self.evict()
+
+    def entries(self):
+        """(ruta, tamaño, último uso) de cada entrada, de la menos a la más usada"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    def evict(self):
+        """Borra las entradas menos usadas hasta quedar por debajo de max_bytes"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,836 @@
+"""Controlador de la máquina: puerto serie, envío de G-code y procesado al cargar.
+
+No depende de Tk: los avisos, el avance y el final del programa se notifican
+con callbacks, así que se puede usar sin pantalla y con varias máquinas en
+el mismo proceso (ver gcode_farm.py).
+"""
+import serial
+import threading
+import time
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from serial.tools import list_ports
+
+from gcode_program import GCodeProgram, LazyGCodeFile, LAZY_THRESHOLD
+from gcode_optimize import compact_program, optimize_travel, simplify_paths
+from gcode_estimate import FIRMWARE_SETTINGS, estimate
+from gcode_telemetry import StreamTelemetry
+from gcode_resume import (CHECKPOINT_INTERVAL, checkpoint_path, lazy_resume_preamble, load_checkpoint,
+                          machine_position, program_fingerprint, remove_checkpoint, resume_preamble,
+                          save_checkpoint)
+
+# Modos de envío de G-code
+STREAM_PING_PONG = "ping-pong"    # Una línea por cada "ok" (modo seguro)
+STREAM_CHAR_COUNT = "char-count"  # Mantiene lleno el buffer RX del firmware
+STREAM_MODES = (STREAM_CHAR_COUNT, STREAM_PING_PONG)
+
+# Tamaño del buffer de recepción serie del Arduino (HardwareSerial) que usa CNC_code.ino
+ARDUINO_RX_BUFFER = 64
+
+# Cada cuánto se vuelve a consultar la lista de puertos del sistema
+PORT_SCAN_INTERVAL = 1.0
+
+# Órdenes manuales: espera máxima del "ok" (un G0 de punta a punta de la mesa
+# tarda unos 10 s) y mayor desplazamiento (mm) que acumula un jog continuo
+COMMAND_TIMEOUT = 30.0
+JOG_MAX_STEP = 5.0
+
+# Prueba de límites: ida y vuelta en X e Y y servo arriba/abajo (el firmware no
+# tiene eje Z y un G0 sin X ni Y lee de un puntero nulo)
+LIMITS_TEST = (
+    "G90",       # Modo absoluto
+    "M300 S50",  # Pluma arriba
+    "G0X0Y0",    # Ir a origen
+    "G0X10",     # Mover X
+    "G0X0",      # Volver
+    "G0Y10",     # Mover Y
+    "G0Y0",      # Volver
+    "M300 S30",  # Bajar servo
+    "M300 S50",  # Subir servo
+)
+
+# Respuesta de M114: "Absolute position : X = 10.00  -  Y = 5.00"
+_M114_RE = re.compile(r'X\s*=\s*([-+]?[\d.]+)\s*-\s*Y\s*=\s*([-+]?[\d.]+)')
+
+def list_serial_ports():
+    """Puertos serie que declara el sistema operativo, sin abrirlos (USB primero)"""
+    ports = sorted(list_ports.comports(), key=lambda port: (port.vid is None, port.device))
+    return [port.device for port in ports]
+
+def probe_ports(ports, baudrate=9600, timeout=0.1):
+    """Comprueba en paralelo qué puertos se pueden abrir
+
+    Abrir el puerto reinicia la mayoría de placas Arduino: usar solo cuando
+    los metadatos del sistema no basten.
+    """
+    def can_open(port):
+        try:
+            serial.Serial(port, baudrate, timeout=timeout).close()
+            return True
+        except (serial.SerialException, OSError, ValueError):
+            return False
+    if not ports:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(ports), 16)) as pool:
+        usable = list(pool.map(can_open, ports))
+    return [port for port, ok in zip(ports, usable) if ok]
+
+class PortWatcher:
+    """Lista de puertos en caché que se actualiza sola al conectar o quitar dispositivos
+
+    Un hilo consulta los metadatos del sistema cada `interval` segundos y
+    llama a callback(puertos) solo cuando la lista cambia. Con probe=True
+    cada puerto nuevo se abre una vez para comprobar que está disponible.
+    """
+    def __init__(self, callback=None, interval=PORT_SCAN_INTERVAL, probe=False):
+        self.callback = callback
+        self.interval = interval
+        self.probe = probe
+        self.ports = []
+        self._probed = {}  # Resultado de la prueba de cada puerto ya visto
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def scan(self, reprobe=False):
+        """Actualiza la caché y devuelve los puertos"""
+        with self._lock:
+            ports = list_serial_ports()
+            if self.probe:
+                if reprobe:
+                    self._probed = {}
+                new = [port for port in ports if port not in self._probed]
+                usable = set(probe_ports(new))
+                self._probed = {port: self._probed.get(port, port in usable) for port in ports}
+                ports = [port for port in ports if self._probed[port]]
+            changed = ports != self.ports
+            self.ports = ports
+        if changed and self.callback:
+            self.callback(list(ports))
+        return ports
+    
+    def refresh(self):
+        """Vuelve a consultar (y a probar) los puertos en segundo plano"""
+        threading.Thread(target=self.scan, kwargs={'reprobe': True}, daemon=True).start()
+    
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+    
+    def _watch(self):
+        while True:
+            try:
+                self.scan()
+            except Exception:
+                pass  # Un fallo puntual al enumerar no debe parar la vigilancia
+            if self._stop.wait(self.interval):
+                break
+
+class GCodeController:
+    def __init__(self, stream_mode=STREAM_CHAR_COUNT, rx_buffer_size=ARDUINO_RX_BUFFER):
+        self.port = None
+        self.port_name = None
+        self.running = True
+        self.streaming = False
+        self.paused = False
+        self.gcode = GCodeProgram.from_lines([])
+        self.gcode_index = 0
+        self.current_line = ""
+        self.log_callback = None  # Callback para logging
+        self.alert_callback = None  # Callback para avisos: (nivel, título, mensaje)
+        self.progress_callback = None  # Callback de avance: (líneas confirmadas, total)
+        self.finished_callback = None  # Callback al completar el programa
+        self.position = {'x': 0, 'y': 0, 'z': 0}  # Posición actual
+        self.machine_limits = {'x': 0, 'y': 0, 'z': 0}  # Límites de la máquina
+        self.stream_mode = stream_mode
+        self.rx_buffer_size = rx_buffer_size
+        self._in_flight = deque()  # Bytes de cada línea enviada que aún espera su "ok"
+        self._in_flight_bytes = 0
+        self._stale_acks = 0  # "ok" pendientes de un streaming anterior ya detenido
+        self._awaiting_ok = False  # Ping-pong: hay una línea del programa esperando su "ok"
+        self._stream_lock = threading.Lock()
+        self.telemetry = StreamTelemetry()  # Marcas de tiempo de cada línea enviada
+        # Procesado al cargar
+        self.reorder_polylines = False  # Reordenar trazos para reducir el recorrido en vacío
+        self.simplify_tolerance = None  # Tolerancia (mm) de simplificación de trazos, None = no simplificar
+        self.compact_wire = False  # Enviar las líneas en formato compacto
+        self.cache = None  # ProgramCache para no recompilar ni reprocesar archivos ya abiertos
+        self.estimates = {}  # Estimaciones del programa cargado por protocolo
+        # Reanudación
+        self.source_file = None  # Archivo del programa cargado
+        self.checkpoint_dir = None  # Directorio de puntos de reanudación, None = no guardarlos
+        self.checkpoint_interval = CHECKPOINT_INTERVAL
+        self.acked_index = 0  # Filas del programa confirmadas con "ok" en el último streaming
+        self._preamble = deque()  # Líneas que restablecen el estado antes de la fila de reanudación
+        self._stream_start = 0  # Fila desde la que empezó el streaming actual
+        self._stream_extra = 0  # Líneas del preámbulo menos filas saltadas
+        self._fingerprint = None
+        self._last_checkpoint = 0.0
+        # Órdenes manuales (jog, macros): las envía un hilo de una en una, esperando cada "ok"
+        self._commands = deque()
+        self._commands_ready = threading.Condition()
+        self._command_busy = False
+        self._command_thread = None
+        self._command_waiting = False  # Se espera el "ok" de una orden manual
+        self._command_acked = threading.Event()
+        self._position_known = False  # self.position corresponde a la de la máquina
+        
+    def set_log_callback(self, callback):
+        self.log_callback = callback
+        
+    def log(self, message):
+        if self.log_callback:
+            self.log_callback(message)
+    
+    def set_alert_callback(self, callback):
+        self.alert_callback = callback
+    
+    def set_progress_callback(self, callback):
+        self.progress_callback = callback
+    
+    def set_finished_callback(self, callback):
+        self.finished_callback = callback
+    
+    def alert(self, level, title, message):
+        """Aviso para el usuario ('error', 'warning' o 'info'); sin callback va al log"""
+        if self.alert_callback:
+            self.alert_callback(level, title, message)
+        else:
+            self.log(f"{title}: {message}")
+    
+    def report_progress(self, done):
+        self.acked_index = done
+        if (self.checkpoint_dir and self.streaming
+                and time.monotonic() - self._last_checkpoint >= self.checkpoint_interval):
+            self.save_checkpoint()
+        if self.progress_callback:
+            self.progress_callback(done, len(self.gcode))
+    
+    @property
+    def executing_index(self):
+        """Índice de la línea que está ejecutando la máquina (la más antigua sin "ok")"""
+        return max(self.gcode_index - max(len(self._in_flight), 1), self._stream_start)
+    
+    def stream_length(self):
+        """Líneas que envía el streaming actual (preámbulo de reanudación incluido)"""
+        return len(self.gcode) + self._stream_extra
+    
+    def set_stream_mode(self, mode, rx_buffer_size=None):
+        """Selecciona el protocolo de envío (no se puede cambiar durante el streaming)"""
+        if mode not in STREAM_MODES:
+            raise ValueError(f"Modo de streaming desconocido: {mode}")
+        if self.streaming:
+            return False
+        self.stream_mode = mode
+        if rx_buffer_size is not None:
+            self.rx_buffer_size = rx_buffer_size
+        return True
+        
+    def find_serial_ports(self):
+        """Encuentra puertos seriales disponibles"""
+        return list_serial_ports()
+    
+    def connect(self, port_name):
+        """Conecta al puerto serial"""
+        if not port_name:
+            return False
+        
+        try:
+            if self.port:
+                self.port.close()
+            
+            self.port = serial.Serial(port_name, 9600, timeout=1)
+            self.port_name = port_name
+            self.running = True
+            self._reset_in_flight()
+            self._stale_acks = 0
+            self._command_waiting = False
+            self._position_known = False
+            
+            # Iniciar hilo de lectura
+            read_thread = threading.Thread(target=self.read_responses, daemon=True)
+            read_thread.start()
+            if self._command_thread is None:
+                self._command_thread = threading.Thread(target=self._command_worker, daemon=True)
+                self._command_thread.start()
+            
+            return True
+        except Exception as e:
+            self.alert("error", "Error", f"Error conectando a {port_name}: {e}")
+            return False
+    
+    def _write_line(self, command):
+        """Escribe una línea en el puerto sin esperas y devuelve los bytes enviados"""
+        # Asegurar que el comando termina con \n
+        if not command.endswith('\n'):
+            command = command + '\n'
+        # Enviar el comando como bytes
+        data = command.encode()
+        self.port.write(data)
+        self.current_line = command.strip()
+        self.log(f"→ {self.current_line}")
+        return len(data)
+    
+    def send_command(self, command):
+        """Envía un comando al puerto serial"""
+        if self.port and self.port.is_open:
+            try:
+                self._write_line(command)
+                # Esperar un momento para asegurar que el Arduino procesa el comando
+                time.sleep(0.1)
+                self.telemetry.slept(0.1)
+                return True
+            except Exception as e:
+                self.log(f"Error enviando comando: {e}")
+                return False
+        return False
+    
+    def read_responses(self):
+        """Lee respuestas del puerto serial"""
+        buffer = b""
+        while self.running and self.port and self.port.is_open:
+            try:
+                # Bloquea hasta que llega al menos un byte (o vence el timeout del
+                # puerto) y luego recoge de una vez todo lo que haya disponible
+                data = self.port.read(1)
+                if not data:
+                    continue
+                waiting = self.port.in_waiting
+                if waiting:
+                    data += self.port.read(waiting)
+            except Exception as e:
+                if self.running:
+                    self.log(f"Error leyendo respuesta: {e}")
+                break
+            self.telemetry.received(len(data))
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                response = line.decode(errors="replace").strip()
+                if response:
+                    self.process_response(response)
+    
+    def process_response(self, response):
+        """Procesa una línea recibida del firmware"""
+        self.log(f"← {response}")
+        # Procesar respuesta de estado
+        if response.startswith("<"):
+            # Ejemplo: <Idle|MPos:0.000,0.000,0.000|FS:0,0>
+            try:
+                pos_str = response.split("MPos:")[1].split("|")[0]
+                x, y, z = map(float, pos_str.split(","))
+                self.position = {'x': x, 'y': y, 'z': z}
+            except:
+                pass
+        elif response.startswith("Absolute position"):
+            # Respuesta de M114 de CNC_code.ino
+            match = _M114_RE.search(response)
+            if match:
+                self.position = dict(self.position, x=float(match.group(1)), y=float(match.group(2)))
+                self._position_known = True
+        elif response.startswith("ok"):
+            self.handle_ok()
+        elif response.startswith("error"):
+            self.log(f"Error en comando: {self.current_line}")
+    
+    def load_gcode(self, filename, lazy=None):
+        """Carga archivo G-code
+
+        Los archivos de más de LAZY_THRESHOLD bytes (o con lazy=True) no se
+        compilan: se leen bajo demanda mientras se indexan en segundo plano.
+        No se puede cambiar de programa durante el streaming.
+        """
+        if self.streaming:
+            self.alert("warning", "Advertencia", "No se puede cargar un archivo durante la ejecución")
+            return False
+        try:
+            if lazy is None:
+                lazy = os.path.getsize(filename) > LAZY_THRESHOLD
+            estimates = {}
+            if lazy:
+                program = LazyGCodeFile(filename)
+            elif self.cache is not None:
+                program, estimates = self._load_cached(filename)
+            else:
+                # Compila el archivo en columnas (opcode, X/Y/Z/F/S/P, línea original)
+                program = self.process_program(GCodeProgram.from_file(filename))
+            self.gcode.close()
+            self.gcode = program
+            self.estimates = estimates
+            self.source_file = filename
+            self._fingerprint = None
+            return True
+        except Exception as e:
+            self.alert("error", "Error", f"Error cargando archivo: {e}")
+            return False
+    
+    def processing_settings(self):
+        """Ajustes que cambian el resultado de process_program"""
+        return {
+            'reorder_polylines': self.reorder_polylines,
+            'simplify_tolerance': self.simplify_tolerance,
+            'compact_wire': self.compact_wire,
+        }
+    
+    def _load_cached(self, filename):
+        """Programa procesado y sus estimaciones, de la caché o calculados y guardados en ella"""
+        key = self.cache.key(filename, self.processing_settings())
+        entry = self.cache.load(key)
+        if entry is not None:
+            program, meta = entry
+            self.log(f"Programa recuperado de la caché ({len(program)} líneas)")
+            return program, meta['estimates']
+        program = self.process_program(GCodeProgram.from_file(filename))
+        estimates = {mode: estimate(program, ping_pong=mode == STREAM_PING_PONG)
+                     for mode in STREAM_MODES}
+        try:
+            self.cache.store(key, program, {'source': os.path.abspath(filename),
+                                            'settings': self.processing_settings(),
+                                            'estimates': estimates})
+        except OSError as e:
+            self.log(f"No se pudo guardar en la caché: {e}")
+        return program, estimates
+    
+    def process_program(self, program):
+        """Aplica las pasadas de procesado activadas a un programa compilado"""
+        if self.simplify_tolerance is not None:
+            program, report = simplify_paths(program, self.simplify_tolerance)
+            self.log(f"Simplificación ({self.simplify_tolerance} mm): "
+                     f"{report['lines_removed']} líneas y {report['bytes_removed']} bytes eliminados")
+        if self.reorder_polylines:
+            program, report = optimize_travel(program)
+            self.log(f"Optimización de recorridos: {report['polylines']} trazos "
+                     f"({report['reversed']} invertidos), pluma levantada "
+                     f"{report['travel_before']:.0f} → {report['travel_after']:.0f} mm, "
+                     f"{report['time_before']:.1f} → {report['time_after']:.1f} s")
+        if self.compact_wire:
+            compacted, report = compact_program(program)
+            if report['equivalent']:
+                program = compacted
+                saved = report['bytes_before'] - report['bytes_after']
+                self.log(f"Compactación: {report['bytes_before']} → {report['bytes_after']} bytes "
+                         f"(-{100.0 * saved / max(report['bytes_before'], 1):.1f}%)")
+            else:
+                self.log("Compactación descartada: el resultado no es equivalente al original")
+        return program
+    
+    def estimate_job(self):
+        """Estima la duración del programa cargado con el protocolo actual"""
+        if not isinstance(self.gcode, GCodeProgram):
+            return None  # Los archivos leídos bajo demanda no están compilados
+        if self.stream_mode not in self.estimates:
+            self.estimates[self.stream_mode] = estimate(
+                self.gcode, ping_pong=self.stream_mode == STREAM_PING_PONG)
+        return self.estimates[self.stream_mode]
+    
+    def _next_line(self):
+        """Siguiente línea a enviar (primero el preámbulo de reanudación) o None al terminar"""
+        if self._preamble:
+            return self._preamble[0]
+        if self.gcode.has_line(self.gcode_index):
+            return self.gcode[self.gcode_index]
+        return None
+    
+    def _advance(self):
+        if self._preamble:
+            self._preamble.popleft()
+        else:
+            self.gcode_index += 1
+    
+    def _line_index(self):
+        """Índice de la siguiente línea para la telemetría (-1 = preámbulo)"""
+        return -1 if self._preamble else self.gcode_index
+    
+    def send_next_gcode_line(self):
+        """Envía la siguiente línea de G-code (modo ping-pong)"""
+        with self._stream_lock:
+            # Se comprueba y se escribe sin soltar el cerrojo: si stop_streaming
+            # llega antes, no sale nada; si llega después, cuenta este "ok" como pendiente
+            if not self.streaming or self.paused or not (self.port and self.port.is_open):
+                return False
+            line = self._next_line()
+            if line is not None:
+                # Se anota antes de escribir: el "ok" puede llegar durante la espera
+                self.telemetry.sent(self._line_index(), len(line.encode()) + 1)
+                try:
+                    self._write_line(line)
+                except Exception as e:
+                    self.log(f"Error enviando comando: {e}")
+                    return False
+                self._awaiting_ok = True
+                self._advance()
+        if line is None:
+            self.finish_streaming()
+            return False
+        # Esperar un momento para asegurar que el Arduino procesa el comando
+        time.sleep(0.1)
+        self.telemetry.slept(0.1)
+        return True
+    
+    def fill_rx_buffer(self):
+        """Envía líneas mientras quepan en el buffer RX del firmware (modo char-count)"""
+        with self._stream_lock:
+            while self.streaming and not self.paused:
+                line = self._next_line()
+                if line is None:
+                    break
+                size = len(line.encode()) + 1  # +1 por el \n
+                # Una línea más larga que el buffer se envía sola, con el buffer vacío
+                if self._in_flight and self._in_flight_bytes + size > self.rx_buffer_size:
+                    break
+                try:
+                    self._write_line(line)
+                except Exception as e:
+                    self.log(f"Error enviando comando: {e}")
+                    return False
+                self.telemetry.sent(self._line_index(), size)
+                self._in_flight.append(size)
+                self._in_flight_bytes += size
+                self._advance()
+        return True
+    
+    def handle_ok(self):
+        """Procesa un "ok" del firmware según el modo de streaming"""
+        with self._stream_lock:
+            if self._stale_acks:
+                self._stale_acks -= 1
+                return
+            if self._command_waiting:
+                self._command_waiting = False
+                self._command_acked.set()
+                return
+            # Todo en la misma sección crítica: stop_streaming no puede contar
+            # como pendiente la línea que se está confirmando
+            self._awaiting_ok = False
+            if self.stream_mode == STREAM_PING_PONG:
+                acked = self.gcode_index
+                done = False
+            else:
+                if self._in_flight:
+                    self._in_flight_bytes -= self._in_flight.popleft()
+                    self.telemetry.acked()
+                # Las líneas del preámbulo van antes que las del programa
+                acked = max(self.gcode_index - len(self._in_flight), self._stream_start)
+                done = (self.streaming and not self._in_flight
+                        and self._next_line() is None)
+        if self.stream_mode == STREAM_PING_PONG:
+            if self.streaming:
+                self.telemetry.acked()
+                self.report_progress(acked)
+            if self.streaming and not self.paused:
+                time.sleep(0.1)
+                self.telemetry.slept(0.1)
+                self.send_next_gcode_line()  # Vuelve a comprobar streaming/paused con el cerrojo
+            return
+        
+        if self.streaming:
+            self.report_progress(acked)
+        if done:
+            self.finish_streaming()
+        elif self.streaming and not self.paused:
+            self.fill_rx_buffer()
+    
+    def _reset_in_flight(self):
+        with self._stream_lock:
+            self._in_flight.clear()
+            self._in_flight_bytes = 0
+    
+    def _send_pending(self):
+        """Envía lo que corresponda según el modo de streaming"""
+        if self.stream_mode == STREAM_CHAR_COUNT:
+            self.fill_rx_buffer()
+        else:
+            self.send_next_gcode_line()
+    
+    def finish_streaming(self):
+        """Marca el programa como completado"""
+        self.streaming = False
+        self._track_position(self.gcode_index)
+        if self.checkpoint_dir and self.source_file:
+            remove_checkpoint(checkpoint_path(self.checkpoint_dir, self.source_file))
+        self.log("G-code ejecutado completamente")
+        if self.finished_callback:
+            self.finished_callback()
+    
+    def start_streaming(self, start=0):
+        """Inicia el streaming de G-code, desde el principio o desde la fila start
+        
+        Al empezar a mitad de programa se envía antes un preámbulo que
+        restablece el estado que habrían dejado las filas saltadas.
+        """
+        if not self.gcode:
+            self.alert("warning", "Advertencia", "No hay G-code cargado")
+            return False
+        if self.commands_pending:
+            self.alert("warning", "Advertencia", "Espera a que terminen las órdenes manuales")
+            return False
+        if start < 0 or not self.gcode.has_line(start):
+            self.alert("warning", "Advertencia", f"El programa no tiene la línea {start + 1}")
+            return False
+        
+        if not self.streaming:
+            preamble = self.resume_preamble(start)
+            if start:
+                self.log(f"Reanudando desde la línea {start + 1}: {' | '.join(preamble)}")
+            if self.checkpoint_dir and self._fingerprint is None:
+                self._fingerprint = program_fingerprint(self.gcode)
+            self._reset_in_flight()
+            self.telemetry.start()
+            self._preamble = deque(preamble)
+            self._stream_start = start
+            self._stream_extra = len(preamble) - start
+            self.acked_index = start
+            self._last_checkpoint = time.monotonic()
+            self._position_known = False
+            self.streaming = True
+            self.paused = False
+            self.gcode_index = start
+            self._send_pending()
+        return True
+    
+    def resume_preamble(self, start):
+        """Líneas que restablecen el estado de la máquina antes de la fila start"""
+        if not start:
+            return []
+        program = self.gcode
+        if not isinstance(program, GCodeProgram):
+            # Archivo bajo demanda: se buscan hacia atrás solo las palabras necesarias
+            preamble = lazy_resume_preamble(program, start)
+            if preamble is not None:
+                return preamble
+            # Programa relativo (G91): hay que compilar las filas anteriores para sumar los desplazamientos
+            self.log(f"Programa en G91: calculando la posición de la línea {start + 1}...")
+            program = GCodeProgram.from_lines(program[index] for index in range(start))
+        return resume_preamble(program, start)
+    
+    def checkpoint(self):
+        """Punto de reanudación del programa cargado tras la última fila confirmada"""
+        return {
+            'file': os.path.abspath(self.source_file),
+            'fingerprint': self._fingerprint,
+            'lines': len(self.gcode),
+            'index': self.acked_index,
+            'saved': time.time(),
+        }
+    
+    def save_checkpoint(self):
+        """Guarda el punto de reanudación (si están activados y hay un archivo cargado)"""
+        if not (self.checkpoint_dir and self.source_file and self._fingerprint):
+            return
+        self._last_checkpoint = time.monotonic()
+        try:
+            save_checkpoint(checkpoint_path(self.checkpoint_dir, self.source_file), self.checkpoint())
+        except OSError as e:
+            self.log(f"No se pudo guardar el punto de reanudación: {e}")
+    
+    def load_checkpoint(self):
+        """Punto de reanudación guardado del programa cargado, o None si no hay o ya no vale"""
+        if not (self.checkpoint_dir and self.source_file):
+            return None
+        checkpoint = load_checkpoint(checkpoint_path(self.checkpoint_dir, self.source_file))
+        if checkpoint is None:
+            return None
+        index = checkpoint.get('index', 0)
+        # has_line y no len(): un archivo bajo demanda puede no estar indexado aún hasta ahí
+        if not (isinstance(index, int) and index > 0 and self.gcode.has_line(index)):
+            return None
+        if self._fingerprint is None:
+            self._fingerprint = program_fingerprint(self.gcode)
+        if checkpoint.get('fingerprint') != self._fingerprint:
+            return None  # El archivo o el procesado han cambiado desde que se guardó
+        return checkpoint
+    
+    def pause_streaming(self):
+        """Pausa el streaming"""
+        self.paused = True
+    
+    def resume_streaming(self):
+        """Reanuda el streaming"""
+        self.paused = False
+        if self.streaming:
+            self._send_pending()
+    
+    def stop_streaming(self):
+        """Detiene el streaming (el punto de reanudación se conserva)"""
+        if self.streaming:
+            self.save_checkpoint()
+        with self._stream_lock:
+            # Con el cerrojo de los envíos: a partir de aquí no sale ninguna línea más
+            was_streaming = self.streaming
+            self.streaming = False
+            self.paused = False
+            sent = 0 if self._preamble else self.gcode_index  # Preámbulo a medias: posición desconocida
+            self.gcode_index = 0
+            self._preamble.clear()
+            self._stream_start = 0
+            # Las líneas ya enviadas todavía contestarán "ok": no deben liberar espacio
+            # en el buffer de un streaming posterior
+            self._stale_acks += len(self._in_flight) + self._awaiting_ok
+            self._awaiting_ok = False
+            self._in_flight.clear()
+            self._in_flight_bytes = 0
+        if was_streaming:
+            self._track_position(sent)
+    
+    def _track_position(self, rows):
+        """Posición de la máquina tras las filas enviadas (las ya enviadas se ejecutan aunque se detenga)"""
+        x, y = machine_position(self.gcode, rows) if rows else (None, None)
+        if x is None and y is None:
+            return  # Ningún movimiento: sigue donde estaba (o desconocida)
+        if (x is None or y is None) and not self._position_known:
+            return
+        self.position = dict(self.position,
+                             x=x if x is not None else self.position['x'],
+                             y=y if y is not None else self.position['y'])
+        self._position_known = True
+    
+    def emergency_stop(self):
+        """Parada de emergencia"""
+        self.clear_commands()
+        if self.port and self.port.is_open:
+            self.port.write(b'\x18')  # Ctrl+X
+            self.stop_streaming()
+    
+    def disconnect(self):
+        """Desconecta el puerto serial"""
+        self.running = False
+        if self.port and self.port.is_open:
+            self.port.close()
+    
+    @property
+    def commands_pending(self):
+        """Hay órdenes manuales en cola o en curso"""
+        with self._commands_ready:
+            return self._command_busy or bool(self._commands)
+    
+    def run_macro(self, commands, callback=None):
+        """Encola una secuencia de órdenes; callback(ok) al terminar
+        
+        Cada orden se envía cuando llega el "ok" de la anterior. No se
+        admiten órdenes manuales durante el streaming.
+        """
+        if self.streaming or not (self.port and self.port.is_open):
+            return False
+        with self._commands_ready:
+            self._commands.append({'commands': list(commands), 'jog': None, 'callback': callback})
+            self._commands_ready.notify()
+        return True
+    
+    def queue_command(self, command, callback=None):
+        """Encola una orden manual sin bloquear"""
+        return self.run_macro([command], callback)
+    
+    def jog(self, dx=0.0, dy=0.0):
+        """Movimiento manual relativo (mm) sin bloquear
+        
+        Mientras no se haya enviado, cada petición se suma a la anterior: al
+        mantener pulsado un botón la máquina recibe un único movimiento más
+        largo en lugar de muchos pequeños (como mucho JOG_MAX_STEP por eje).
+        """
+        if self.streaming or not (self.port and self.port.is_open):
+            return False
+        with self._commands_ready:
+            last = self._commands[-1] if self._commands else None
+            if last is not None and last['jog'] is not None:
+                jx, jy = last['jog']
+                last['jog'] = (max(-JOG_MAX_STEP, min(jx + dx, JOG_MAX_STEP)),
+                               max(-JOG_MAX_STEP, min(jy + dy, JOG_MAX_STEP)))
+            else:
+                self._commands.append({'commands': None, 'jog': (dx, dy), 'callback': None})
+                self._commands_ready.notify()
+        return True
+    
+    def clear_commands(self):
+        """Descarta las órdenes manuales que aún no se han enviado"""
+        with self._commands_ready:
+            dropped = list(self._commands)
+            self._commands.clear()
+        for item in dropped:
+            if item['callback']:
+                item['callback'](False)
+    
+    def _command_worker(self):
+        """Hilo que envía las órdenes manuales en orden, fuera del hilo de la interfaz"""
+        while True:
+            with self._commands_ready:
+                while not self._commands or self.streaming:
+                    self._commands_ready.wait(0.5)
+                item = self._commands.popleft()
+                self._command_busy = True
+            try:
+                ok = self._run_item(item)
+            except Exception as e:
+                self.log(f"Error enviando comando: {e}")
+                ok = False
+            finally:
+                with self._commands_ready:
+                    self._command_busy = False
+            if item['callback']:
+                item['callback'](ok)
+    
+    def _run_item(self, item):
+        if item['jog'] is None:
+            for command in item['commands']:
+                if 'G' in command.upper():
+                    # Movimientos, G92...: ya no se sabe dónde está la máquina
+                    self._position_known = False
+                if not self._send_and_wait(command):
+                    return False
+            if not self._position_known:
+                # Se pregunta al terminar para que la posición mostrada sea la real
+                self._send_and_wait("M114")
+            return True
+        if not self._position_known and not self._send_and_wait("M114"):
+            return False
+        dx, dy = item['jog']
+        x = max(FIRMWARE_SETTINGS['Xmin'], min(self.position['x'] + dx, FIRMWARE_SETTINGS['Xmax']))
+        y = max(FIRMWARE_SETTINGS['Ymin'], min(self.position['y'] + dy, FIRMWARE_SETTINGS['Ymax']))
+        # Absoluto: el firmware no implementa G91 (lee "G9" y el G0 siguiente como absoluto)
+        if not self._send_and_wait(f"G0 X{x:.2f} Y{y:.2f}"):
+            return False
+        self.position = dict(self.position, x=x, y=y)
+        self._position_known = True
+        return True
+    
+    def _send_and_wait(self, command, timeout=COMMAND_TIMEOUT):
+        """Envía una orden manual y espera su "ok" en lugar de una pausa fija"""
+        if not (self.port and self.port.is_open):
+            return False
+        with self._stream_lock:
+            self._command_acked.clear()
+            self._command_waiting = True
+        try:
+            self._write_line(command)
+        except Exception as e:
+            self.log(f"Error enviando comando: {e}")
+            with self._stream_lock:
+                self._command_waiting = False
+            return False
+        if self._command_acked.wait(timeout):
+            return True
+        with self._stream_lock:
+            if self._command_waiting:
+                # Si el "ok" llega tarde no debe confirmar la orden siguiente
+                self._command_waiting = False
+                self._stale_acks += 1
+        self.log(f"Sin respuesta a {command} en {timeout:.0f} s")
+        return False
+    
+    def get_status(self):
+        """Obtiene el estado actual de la máquina"""
+        self.queue_command("?")
+    
+    def set_origin(self):
+        """Establece la posición actual como origen"""
+        self.queue_command("G92X0Y0Z0")
+        self.position = {'x': 0, 'y': 0, 'z': 0}
+    
+    def test_limits(self, callback=None):
+        """Prueba los límites de la máquina (sin bloquear; callback(ok) al terminar)"""
+        return self.run_macro(LIMITS_TEST, callback)
@@ -0,0 +1,197 @@
+"""Estimación del tiempo de un trabajo simulando CNC_code.ino.
+
+Reproduce con NumPy lo que hace el firmware con cada línea: drawLine()
+recorta el destino a los límites, lo pasa a pasos con StepsPerMillimeterX/Y
+y avanza por Bresenham (un onestep por paso del eje mayor y otro por cada
+paso del menor, más StepDelay por paso y LineDelay por línea); M300 S30/S50
+mueven el servo y esperan penDelay. A eso se suma la transmisión serie a la
+velocidad configurada y la espera propia del protocolo de envío.
+
+Uso:
+    python gcode_estimate.py [--ping-pong] [--baud 9600] archivo_o_directorio...
+"""
+import argparse
+import glob
+import os
+import sys
+
+import numpy as np
+
+from gcode_program import (GCodeProgram, M_BASE, OP_G4, OP_M114,
+                           OP_M300, OP_RAW, PEN_DOWN_S, PEN_UP_S, ffill)
+
+# Parámetros de CNC_code.ino (mismos nombres que en el firmware)
+FIRMWARE_SETTINGS = {
+    'StepsPerMillimeterX': 200.0,
+    'StepsPerMillimeterY': 200.0,
+    'StepDelay': 0,     # ms por paso
+    'LineDelay': 0,     # ms por línea
+    'penDelay': 50,     # ms tras mover el servo
+    'Xmin': 0.0,
+    'Xmax': 150.0,
+    'Ymin': 0.0,
+    'Ymax': 150.0,
+    'baud': 9600,
+    # Duración de un onestep(MICROSTEP) de AFMotor (latch por registro de
+    # desplazamiento + PWM); no está en el firmware, hay que medirla
+    'step_time': 0.00015,
+    # El firmware solo entiende G0/G1: G4 no espera. Activar para firmwares
+    # que sí implementen la pausa
+    'honor_dwell': False,
+}
+
+# Pausas fijas del modo ping-pong de GCodeController (send_command y handle_ok)
+PING_PONG_DELAY = 0.1
+
+_OK_REPLY = len("ok\r\n")
+_UNKNOWN_M_REPLY = len("Command not recognized : M\r\n")
+_M114_REPLY = len("Absolute position : X = 0.00  -  Y = 0.00\r\n")
+
+
+def firmware_positions(program):
+    """Destino (mm, float32) de cada fila tal como lo calcula el firmware.
+
+    El firmware no conoce G92 ni G91: la posición solo cambia con G0/G1 y
+    la coordenada que falta se toma de la posición anterior.
+    """
+    data = program.data
+    moves = program.is_moves() & ~(np.isnan(data['x']) & np.isnan(data['y']))
+    coords = []
+    for word in ('x', 'y'):
+        values = data[word]
+        coords.append(ffill(values, moves & ~np.isnan(values), np.float32(0)))
+    return coords[0], coords[1], moves
+
+
+def estimate(program, ping_pong=False, **settings):
+    """Estima la duración de un programa compilado.
+
+    Devuelve un diccionario con el tiempo total (s), el desglose por fases
+    ('draw', 'travel', 'pen', 'dwell', 'serial', 'host') y las distancias
+    dibujada y en vacío (mm) que recorre realmente la máquina.
+    """
+    config = dict(FIRMWARE_SETTINGS, **settings)
+    data = program.data
+    n = len(data)
+    op = data['op']
+
+    # Movimientos: recorte a los límites y conversión a pasos como en drawLine
+    x, y, moves = firmware_positions(program)
+    spm_x = np.float32(config['StepsPerMillimeterX'])
+    spm_y = np.float32(config['StepsPerMillimeterY'])
+    x = np.clip(x, np.float32(config['Xmin']), np.float32(config['Xmax']))
+    y = np.clip(y, np.float32(config['Ymin']), np.float32(config['Ymax']))
+    step_x = (x * spm_x).astype(np.int64)
+    step_y = (y * spm_y).astype(np.int64)
+    # Xpos/Ypos solo cambian en las filas de movimiento
+    move_rows = np.flatnonzero(moves)
+    dx = np.zeros(n, dtype=np.int64)
+    dy = np.zeros(n, dtype=np.int64)
+    dx[move_rows] = np.abs(np.diff(step_x[move_rows], prepend=0))
+    dy[move_rows] = np.abs(np.diff(step_y[move_rows], prepend=0))
+    execution = np.zeros(n)
+    execution[move_rows] = ((dx + dy)[move_rows] * config['step_time']
+                            + np.maximum(dx, dy)[move_rows] * config['StepDelay'] / 1000.0
+                            + config['LineDelay'] / 1000.0)
+    distance = np.hypot(dx / float(spm_x), dy / float(spm_y))
+
+    # Servo: el firmware compara S exactamente con 30 y 50
+    pen_moves = (op == OP_M300) & ((data['s'] == PEN_DOWN_S) | (data['s'] == PEN_UP_S))
+    pen_time = np.where(pen_moves, config['penDelay'] / 1000.0, 0.0)
+    pen = np.zeros(n, dtype=bool)
+    pen[1:] = program.pen_states()[:-1]
+
+    dwell = np.zeros(n)
+    if config['honor_dwell']:
+        g4 = (op == OP_G4) & ~np.isnan(data['p'])
+        dwell[g4] = data['p'][g4] / 1000.0
+
+    device = execution + pen_time + dwell
+
+    # Puerto serie: 10 bits por byte (8N1) en cada sentido
+    byte_time = 10.0 / config['baud']
+    sent = program.wire_lengths() * byte_time
+    reply = np.full(n, _OK_REPLY, dtype=np.int64)
+    known_m = (op == OP_M300) | (op == OP_M114) | (op < M_BASE) | (op == OP_RAW)
+    reply[~known_m] += _UNKNOWN_M_REPLY + 3
+    reply[op == OP_M114] += _M114_REPLY
+    received = reply * byte_time
+
+    if ping_pong:
+        # Cada línea: pausa tras el "ok", envío, y la pausa tras escribir se
+        # solapa con la transmisión y la ejecución
+        per_line = PING_PONG_DELAY + np.maximum(PING_PONG_DELAY, sent + device + received)
+        serial = sent + received
+    else:
+        # Con el buffer lleno la transmisión se solapa con la ejecución: cada
+        # línea cuesta lo que el más lento de la recepción, la ejecución o el "ok"
+        per_line = np.maximum(device, np.maximum(sent, received))
+        if n:
+            per_line[0] += sent[0]  # La primera línea no se solapa con nada
+        serial = per_line - device
+    total = float(per_line.sum())
+    serial_time = float(serial.sum())
+
+    draw = moves & pen
+    travel = moves & ~pen
+    phases = {
+        'draw': float(execution[draw].sum()),
+        'travel': float(execution[travel].sum()),
+        'pen': float(pen_time.sum()),
+        'dwell': float(dwell.sum()),
+        'serial': serial_time,
+    }
+    phases['host'] = max(total - sum(phases.values()), 0.0)
+    return {
+        'total': total,
+        'phases': phases,
+        'lines': n,
+        'bytes': int(program.wire_lengths().sum()),
+        'draw_distance': float(distance[draw].sum()),
+        'travel_distance': float(distance[travel].sum()),
+    }
+
+
+def format_duration(seconds):
+    """Duración legible: 1 h 02 min 03 s"""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours} h {minutes:02d} min {seconds:02d} s"
+    if minutes:
+        return f"{minutes} min {seconds:02d} s"
+    return f"{seconds} s"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estima la duración de archivos G-code")
+    parser.add_argument('paths', nargs='+', help="archivos .gcode o directorios")
+    parser.add_argument('--ping-pong', action='store_true', help="protocolo de una línea por ok")
+    parser.add_argument('--baud', type=int, default=FIRMWARE_SETTINGS['baud'])
+    parser.add_argument('--step-time', type=float, default=FIRMWARE_SETTINGS['step_time'],
+                        help="segundos por onestep del motor")
+    args = parser.parse_args(argv)
+
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.gcode'))))
+        else:
+            files.append(path)
+
+    print(f"{'archivo':<28} {'líneas':>7} {'total':>14} {'dibujo':>8} {'vacío':>8} "
+          f"{'pluma':>8} {'serie':>8} {'espera':>8} {'mm dib.':>9} {'mm vacío':>9}")
+    for filename in files:
+        result = estimate(GCodeProgram.from_file(filename), ping_pong=args.ping_pong,
+                          baud=args.baud, step_time=args.step_time)
+        phases = result['phases']
+        print(f"{os.path.basename(filename)[:28]:<28} {result['lines']:>7} "
+              f"{format_duration(result['total']):>14} {phases['draw']:>8.1f} "
+              f"{phases['travel']:>8.1f} {phases['pen']:>8.1f} {phases['serial']:>8.1f} "
+              f"{phases['host']:>8.1f} {result['draw_distance']:>9.1f} "
+              f"{result['travel_distance']:>9.1f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,315 @@
+"""Granja de plotters: reparte una cola de archivos G-code entre varias máquinas.
+
+Cada puerto tiene su propio GCodeController y un hilo que toma el siguiente
+archivo de la cola, lo carga, lo envía y espera a que termine; en cuanto una
+máquina queda libre coge el siguiente trabajo. El avance y los resultados se
+notifican con callbacks, sin ventanas, así que funciona sin pantalla.
+
+Uso:
+    python gcode_farm.py --port /dev/ttyUSB0 --port /dev/ttyUSB1 archivo_o_directorio...
+"""
+import argparse
+import glob
+import os
+import queue
+import sys
+import threading
+import time
+
+from gcode_cache import ProgramCache
+from gcode_controller import GCodeController, STREAM_CHAR_COUNT, STREAM_MODES
+from gcode_estimate import format_duration
+
+# El Arduino se reinicia al abrir el puerto: tiempo hasta que el firmware escucha
+BOOT_DELAY = 2.0
+
+# Una máquina se retira si pasa este tiempo sin contestar "ok"; su trabajo vuelve a la cola
+STALL_TIMEOUT = 30.0
+
+# Cada cuánto se notifica el avance de cada máquina
+PROGRESS_INTERVAL = 1.0
+
+
+class Machine:
+    """Un plotter de la granja y el estado de su trabajo actual"""
+
+    def __init__(self, port, controller):
+        self.port = port
+        self.controller = controller
+        self.filename = None
+        self.done = 0          # Líneas confirmadas con "ok"
+        self.total = 0
+        self.started = 0.0
+        self.last_ack = 0.0
+        self.error = None
+        self.finished = threading.Event()
+
+    def status(self):
+        """Foto del avance del trabajo actual"""
+        elapsed = time.perf_counter() - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.total - self.done, 0)
+        return {
+            'port': self.port,
+            'file': self.filename,
+            'done': self.done,
+            'total': self.total,
+            'elapsed': elapsed,
+            'lines_per_s': rate,
+            'eta': remaining / rate if rate else None,
+        }
+
+
+class JobFarm:
+    """Cola de archivos G-code repartida entre varios puertos serie.
+
+    Callbacks (se llaman desde los hilos de las máquinas):
+      on_progress(status)  avance periódico de una máquina (ver Machine.status)
+      on_job_done(result)  fin de un trabajo, con 'ok', 'error' y 'requeued' (el
+                           archivo ha vuelto a la cola para otra máquina)
+      on_log(port, message)  log de comunicación de cada controlador
+    """
+
+    def __init__(self, ports, stream_mode=STREAM_CHAR_COUNT, boot_delay=BOOT_DELAY,
+                 stall_timeout=STALL_TIMEOUT, on_progress=None, on_job_done=None,
+                 on_log=None, reorder_polylines=False, simplify_tolerance=None,
+                 compact_wire=False, cache=None):
+        self.jobs = queue.Queue()
+        self.results = []
+        self.boot_delay = boot_delay
+        self.stall_timeout = stall_timeout
+        self.on_progress = on_progress
+        self.on_job_done = on_job_done
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._active = 0  # Trabajos en curso: pueden volver a la cola si su máquina falla
+        self._threads = []
+        self.machines = []
+        for port in ports:
+            controller = GCodeController(stream_mode=stream_mode)
+            controller.reorder_polylines = reorder_polylines
+            controller.simplify_tolerance = simplify_tolerance
+            controller.compact_wire = compact_wire
+            controller.cache = cache
+            machine = Machine(port, controller)
+            if on_log:
+                controller.set_log_callback(lambda message, port=port: on_log(port, message))
+            controller.set_alert_callback(
+                lambda level, title, message, machine=machine: self._alert(machine, level, message))
+            controller.set_progress_callback(
+                lambda done, total, machine=machine: self._progress(machine, done, total))
+            controller.set_finished_callback(machine.finished.set)
+            self.machines.append(machine)
+
+    def add_job(self, filename):
+        self.jobs.put(filename)
+
+    def stop(self):
+        """Detiene los trabajos en curso y no empieza ninguno más"""
+        self._stop.set()
+
+    def start(self):
+        """Pone a trabajar todas las máquinas en segundo plano"""
+        self._threads = [threading.Thread(target=self._worker, args=(machine,), daemon=True)
+                         for machine in self.machines]
+        for thread in self._threads:
+            thread.start()
+
+    def run(self):
+        """Procesa la cola con todas las máquinas y devuelve los resultados"""
+        self.start()
+        return self.join()
+
+    def join(self):
+        """Espera a que las máquinas terminen y devuelve los resultados"""
+        for thread in self._threads:
+            thread.join()
+        # Lo que queda en la cola no ha llegado a ninguna máquina
+        while True:
+            try:
+                filename = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            self._finish(None, filename, 0, 0, 0.0, "sin máquina disponible")
+        return self.results
+
+    def _alert(self, machine, level, message):
+        if level == "error":
+            machine.error = message
+
+    def _progress(self, machine, done, total):
+        machine.done = done
+        machine.total = total
+        machine.last_ack = time.perf_counter()
+
+    def _worker(self, machine):
+        controller = machine.controller
+        machine.error = None
+        if not controller.connect(machine.port):
+            self._finish(machine.port, None, 0, 0, 0.0, machine.error)
+            return
+        try:
+            time.sleep(self.boot_delay)
+            while not self._stop.is_set():
+                filename = self._next_job()
+                if filename is None:
+                    break
+                try:
+                    responsive = self._run_job(machine, filename)
+                finally:
+                    with self._lock:
+                        self._active -= 1
+                if not responsive:
+                    # Una máquina que no contesta no recibe más trabajos
+                    break
+        finally:
+            controller.disconnect()
+
+    def _next_job(self):
+        """Siguiente archivo de la cola, o None cuando no queda nada por hacer
+
+        Con la cola vacía se espera mientras haya trabajos en curso en otras
+        máquinas: si una deja de contestar, su archivo vuelve a la cola.
+        """
+        while not self._stop.is_set():
+            with self._lock:
+                try:
+                    filename = self.jobs.get_nowait()
+                except queue.Empty:
+                    if not self._active:
+                        return None
+                else:
+                    self._active += 1
+                    return filename
+            time.sleep(PROGRESS_INTERVAL)
+        return None
+
+    def _run_job(self, machine, filename):
+        controller = machine.controller
+        machine.filename = filename
+        machine.error = None
+        machine.done = 0
+        machine.finished.clear()
+        if not controller.load_gcode(filename):
+            self._finish(machine.port, filename, 0, 0, 0.0, machine.error)
+            return True
+        machine.total = len(controller.gcode)
+        machine.started = machine.last_ack = time.perf_counter()
+        if not controller.start_streaming():
+            self._finish(machine.port, filename, 0, 0, 0.0, "programa vacío")
+            return True
+        error = None
+        responsive = True
+        while not machine.finished.wait(PROGRESS_INTERVAL):
+            if self._stop.is_set():
+                error = "cancelado"
+            elif time.perf_counter() - machine.last_ack > self.stall_timeout:
+                error = f"sin respuesta durante {self.stall_timeout:.0f} s"
+                responsive = False
+            if error:
+                controller.stop_streaming()
+                break
+            if self.on_progress:
+                self.on_progress(machine.status())
+        else:
+            machine.done = machine.total = len(controller.gcode)
+        status = machine.status()
+        requeued = not responsive and not self._stop.is_set()
+        if requeued:
+            # Otra máquina lo repetirá entero (se encola antes de dejar de contar como en curso)
+            self.jobs.put(filename)
+        self._finish(machine.port, filename, status['done'], status['total'],
+                     status['elapsed'], error, requeued)
+        return responsive
+
+    def _finish(self, port, filename, done, total, elapsed, error, requeued=False):
+        result = {
+            'port': port,
+            'file': filename,
+            'lines': done,
+            'total': total,
+            'elapsed': elapsed,
+            'lines_per_s': done / elapsed if elapsed > 0 else 0.0,
+            'ok': error is None and filename is not None,
+            'error': error,
+            'requeued': requeued,
+        }
+        self.results.append(result)
+        if self.on_job_done:
+            self.on_job_done(result)
+
+
+def print_progress(status):
+    eta = format_duration(status['eta']) if status['eta'] is not None else "?"
+    percent = 100.0 * status['done'] / max(status['total'], 1)
+    print(f"[{status['port']}] {os.path.basename(status['file'])}: "
+          f"{status['done']}/{status['total']} ({percent:.1f}%) "
+          f"{status['lines_per_s']:.1f} líneas/s, quedan {eta}", flush=True)
+
+
+def print_result(result):
+    if result['file'] is None:
+        print(f"[{result['port']}] no disponible: {result['error']}", flush=True)
+    elif result['ok']:
+        print(f"[{result['port']}] {os.path.basename(result['file'])} completado: "
+              f"{result['lines']} líneas en {format_duration(result['elapsed'])} "
+              f"({result['lines_per_s']:.1f} líneas/s)", flush=True)
+    else:
+        retry = " (vuelve a la cola)" if result['requeued'] else ""
+        print(f"[{result['port'] or '-'}] {os.path.basename(result['file'])} falló: "
+              f"{result['error']}{retry}", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reparte archivos G-code entre varios plotters")
+    parser.add_argument('paths', nargs='+', help="archivos .gcode o directorios")
+    parser.add_argument('--port', action='append', required=True,
+                        help="puerto serie de una máquina (repetir para cada una)")
+    parser.add_argument('--protocol', choices=STREAM_MODES, default=STREAM_CHAR_COUNT)
+    parser.add_argument('--reorder', action='store_true', help="optimizar recorridos")
+    parser.add_argument('--simplify', type=float, metavar='MM',
+                        help="simplificar trazos con esta tolerancia")
+    parser.add_argument('--compact', action='store_true', help="compactar comandos")
+    parser.add_argument('--boot-delay', type=float, default=BOOT_DELAY,
+                        help="espera tras abrir el puerto (s)")
+    parser.add_argument('--stall-timeout', type=float, default=STALL_TIMEOUT,
+                        help="tiempo máximo sin respuesta (s)")
+    parser.add_argument('--no-cache', action='store_true', help="no usar la caché de programas")
+    parser.add_argument('--verbose', action='store_true', help="mostrar la comunicación serie")
+    args = parser.parse_args(argv)
+
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.gcode'))))
+        else:
+            files.append(path)
+
+    farm = JobFarm(args.port, stream_mode=args.protocol, boot_delay=args.boot_delay,
+                   stall_timeout=args.stall_timeout, on_progress=print_progress,
+                   on_job_done=print_result,
+                   on_log=(lambda port, message: print(f"[{port}] {message}", flush=True))
+                   if args.verbose else None,
+                   reorder_polylines=args.reorder, simplify_tolerance=args.simplify,
+                   compact_wire=args.compact,
+                   cache=None if args.no_cache else ProgramCache())
+    for filename in files:
+        farm.add_job(filename)
+    started = time.perf_counter()
+    farm.start()
+    try:
+        results = farm.join()
+    except KeyboardInterrupt:
+        print("Cancelando...", flush=True)
+        farm.stop()
+        results = farm.join()
+    # Los intentos que volvieron a la cola no cuentan: el archivo tiene otro resultado
+    jobs = [result for result in results if result['file'] is not None and not result['requeued']]
+    completed = sum(result['ok'] for result in jobs)
+    print(f"{completed}/{len(jobs)} trabajos completados en "
+          f"{format_duration(time.perf_counter() - started)} con {len(args.port)} máquinas")
+    return 0 if completed == len(jobs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
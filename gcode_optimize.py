@@ -0,0 +1,630 @@
+"""Pasadas de optimización sobre un GCodeProgram ya compilado.
+
+optimize_travel() reordena (y si conviene invierte) los trazos con la pluma
+bajada para reducir el recorrido con la pluma levantada. simplify_paths()
+elimina los puntos intermedios de los trazos que se apartan menos de una
+tolerancia de la línea simplificada. compact_program() reduce los bytes que
+se envían por cada línea.
+"""
+import math
+import time
+
+import numpy as np
+
+from gcode_program import (GCodeProgram, OP_G1, OP_G4, OP_G90, OP_G91, OP_G92, OP_M300, OP_RAW,
+                           PEN_DOWN_S, PEN_UP_S, WORDS, compact_text)
+
+# Decimales que aprovecha el firmware: StepsPerMillimeterX/Y = 200 (0.005 mm por paso)
+FIRMWARE_DECIMALS = 3
+
+# Vecinos que se consideran para cada extremo en la mejora 2-opt
+TWO_OPT_NEIGHBOURS = 8
+# Límites de la mejora 2-opt
+TWO_OPT_PASSES = 20
+TWO_OPT_TIME = 5.0
+
+
+def path_stats(program, start=(0.0, 0.0)):
+    """Distancias (mm) y tiempos (s, al avance F programado) con la pluma
+    levantada y bajada"""
+    x, y = program.positions(start)
+    moves = program.is_moves()
+    length = np.hypot(np.diff(x, prepend=start[0]), np.diff(y, prepend=start[1]))
+    length[~moves] = 0.0
+    # Estado de la pluma durante cada fila = estado tras la fila anterior
+    pen = np.zeros(len(length), dtype=bool)
+    pen[1:] = program.pen_states()[:-1]
+    feed = program.feeds() / 60.0
+    seconds = np.divide(length, feed, out=np.zeros_like(length), where=feed > 0)
+    return {
+        'pen_up_distance': float(length[~pen].sum()),
+        'pen_down_distance': float(length[pen].sum()),
+        'pen_up_time': float(seconds[~pen].sum()),
+        'pen_down_time': float(seconds[pen].sum()),
+    }
+
+
+def find_polylines(program):
+    """Localiza los trazos que se pueden reordenar.
+
+    Un trazo es: movimiento de posicionamiento, G4 opcionales, M300 S30,
+    movimientos/G4 con la pluma bajada, M300 S50 y G4 opcionales. Devuelve
+    una lista de grupos de trazos consecutivos; cada trazo es una tupla
+    (t, m, u, e, reversible) con las filas del posicionamiento, del primer
+    movimiento con la pluma bajada, de subida y la última fila del trazo.
+    Cualquier otra fila entre trazos separa grupos y se queda en su sitio,
+    también un bloque cuyo posicionamiento se hace con la pluma bajada
+    (dos M300 S30 seguidos): ese movimiento es parte del dibujo.
+    """
+    data = program.data
+    n = len(data)
+    op = data['op']
+    s = data['s']
+    moves = program.is_moves() & ~(np.isnan(data['x']) & np.isnan(data['y']))
+    last_move = np.maximum.accumulate(np.where(moves, np.arange(n), -1)) if n else moves
+    is_g4 = op == OP_G4
+    pen_up = np.flatnonzero((op == OP_M300) & (s == PEN_UP_S))
+    pen_down = np.flatnonzero((op == OP_M300) & (s == PEN_DOWN_S))
+    pen = program.pen_states()
+
+    groups = []
+    group = []
+    previous_end = -1
+    for k, d in enumerate(pen_down):
+        d = int(d)
+        t = int(last_move[d - 1]) if d else -1
+        up_index = np.searchsorted(pen_up, d)
+        next_down = pen_down[k + 1] if k + 1 < len(pen_down) else n
+        if t <= previous_end or up_index == len(pen_up) or pen_up[up_index] > next_down:
+            continue
+        if t > 0 and pen[t - 1]:
+            continue  # El posicionamiento dibuja: no se mueve ni se invierte
+        u = int(pen_up[up_index])
+        if not is_g4[t + 1:d].all():
+            continue
+        m = d + 1
+        while m < u and is_g4[m]:
+            m += 1
+        inside = slice(m, u)
+        if not (moves[inside] | is_g4[inside]).all():
+            continue
+        e = u
+        while e + 1 < n and is_g4[e + 1]:
+            e += 1
+        feeds = data['f'][inside]
+        reversible = bool(
+            u > m
+            and moves[inside].all()
+            and np.isnan(data['z'][inside]).all()
+            and (np.isnan(feeds).all() or (feeds == feeds[0]).all())
+        )
+        if group and t != previous_end + 1:
+            groups.append(group)
+            group = []
+        group.append((t, m, u, e, reversible))
+        previous_end = e
+    if group:
+        groups.append(group)
+    return groups
+
+
+class _Grid:
+    """Índice espacial en rejilla para buscar el extremo libre más cercano"""
+
+    def __init__(self, points, cell):
+        self.points = points
+        self.cell = cell
+        self.origin = points.min(axis=0)
+        keys = np.floor((points - self.origin) / cell).astype(np.int64)
+        self.size = keys.max(axis=0) + 1
+        self.cells = {}
+        self.key_of = {}
+        self.count = 0
+        for pid, (kx, ky) in enumerate(keys.tolist()):
+            self.key_of[pid] = (kx, ky)
+
+    def add(self, pid):
+        self.cells.setdefault(self.key_of[pid], []).append(pid)
+        self.count += 1
+
+    def remove(self, pid):
+        key = self.key_of[pid]
+        cell = self.cells.get(key)
+        if cell and pid in cell:
+            cell.remove(pid)
+            if not cell:
+                del self.cells[key]
+            self.count -= 1
+
+    def nearest(self, point):
+        """Extremo libre más cercano a point (None si no queda ninguno)"""
+        if not self.count:
+            return None
+        cx = int(math.floor((point[0] - self.origin[0]) / self.cell))
+        cy = int(math.floor((point[1] - self.origin[1]) / self.cell))
+        nx, ny = int(self.size[0]), int(self.size[1])
+        # Radio máximo para cubrir la rejilla entera desde (cx, cy)
+        max_r = max(abs(cx), abs(cy), abs(nx - 1 - cx), abs(ny - 1 - cy))
+        best = None
+        best_d = math.inf
+        px, py = point
+        points = self.points
+        for r in range(max_r + 1):
+            for key in self._ring(cx, cy, r, nx, ny):
+                for pid in self.cells.get(key, ()):
+                    qx, qy = points[pid]
+                    dist = math.hypot(qx - px, qy - py)
+                    if dist < best_d:
+                        best, best_d = pid, dist
+            # Cualquier celda del anillo siguiente está al menos a r * cell
+            if best is not None and best_d <= r * self.cell:
+                break
+        return best
+
+    @staticmethod
+    def _ring(cx, cy, r, nx, ny):
+        if r == 0:
+            yield (cx, cy)
+            return
+        x0, x1 = max(cx - r, 0), min(cx + r, nx - 1)
+        y0, y1 = max(cy - r + 1, 0), min(cy + r - 1, ny - 1)
+        for y in (cy - r, cy + r):
+            if 0 <= y < ny:
+                for x in range(x0, x1 + 1):
+                    yield (x, y)
+        for x in (cx - r, cx + r):
+            if 0 <= x < nx:
+                for y in range(y0, y1 + 1):
+                    yield (x, y)
+
+
+def _cell_size(points):
+    span = np.ptp(points, axis=0).max() if len(points) else 0.0
+    area = max(np.prod(np.maximum(np.ptp(points, axis=0), 1e-3)), 1e-6)
+    return max(math.sqrt(area / max(len(points), 1)) * 1.5, span * 1e-4, 1e-3)
+
+
+def _nearest_neighbour_tour(starts, ends, reversible, origin):
+    """Recorrido inicial: siempre al extremo libre más cercano"""
+    n = len(starts)
+    points = np.empty((2 * n, 2))
+    points[0::2] = starts
+    points[1::2] = ends
+    grid = _Grid(points, _cell_size(points))
+    for b in range(n):
+        grid.add(2 * b)
+        if reversible[b]:
+            grid.add(2 * b + 1)
+    order = np.empty(n, dtype=np.intp)
+    flip = np.zeros(n, dtype=bool)
+    current = origin
+    for k in range(n):
+        pid = grid.nearest(current)
+        b, flipped = divmod(pid, 2)
+        grid.remove(2 * b)
+        grid.remove(2 * b + 1)
+        order[k] = b
+        flip[k] = bool(flipped)
+        current = starts[b] if flipped else ends[b]
+    return order, flip, points
+
+
+def _neighbours(points, k):
+    """k extremos más cercanos de cada extremo (rejilla de 3x3 celdas, -1 = ninguno)"""
+    cell = _cell_size(points) * 2
+    keys = np.floor((points - points.min(axis=0)) / cell).astype(np.int64)
+    buckets = {}
+    for pid, key in enumerate(map(tuple, keys.tolist())):
+        buckets.setdefault(key, []).append(pid)
+    result = np.full((len(points), k), -1, dtype=np.intp)
+    for (kx, ky), members in buckets.items():
+        candidates = [pid for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                      for pid in buckets.get((kx + dx, ky + dy), ())]
+        members = np.array(members)
+        candidates = np.array(candidates)
+        dist = np.hypot(*(points[members][:, None, :] - points[candidates][None, :, :]).transpose(2, 0, 1))
+        dist[members[:, None] == candidates[None, :]] = np.inf
+        m = min(k, len(candidates) - 1)
+        if m <= 0:
+            continue
+        nearest = np.argsort(dist, axis=1)[:, :m]
+        result[members, :m] = candidates[nearest]
+    return result
+
+
+def _tour_cost(order, flip, points, origin, end):
+    """Recorrido con la pluma levantada de un orden de trazos"""
+    heads = points[2 * order + flip]
+    tails = points[2 * order + 1 - flip]
+    previous = np.vstack(([origin], tails[:-1]))
+    cost = np.hypot(*(heads - previous).T).sum()
+    if end is not None:
+        cost += math.hypot(tails[-1][0] - end[0], tails[-1][1] - end[1])
+    return cost
+
+
+def _two_opt(order, flip, points, reversible, origin, end, deadline):
+    """Mejora 2-opt con listas de vecinos sobre un recorrido abierto
+
+    Si end no es None el recorrido tiene que terminar yendo a ese punto.
+    """
+    n = len(order)
+    pos = np.empty(n, dtype=np.intp)
+    pos[order] = np.arange(n)
+    neighbours = _neighbours(points, TWO_OPT_NEIGHBOURS)
+
+    # Extremo de salida (cola) y de llegada (cabeza) del trazo en la posición k
+    def tail_id(k):
+        return 2 * order[k] + (0 if flip[k] else 1)
+
+    def head_id(k):
+        return 2 * order[k] + (1 if flip[k] else 0)
+
+    def tail(k):
+        return origin if k < 0 else points[tail_id(k)]
+
+    def head(k):
+        return end if k >= n else points[head_id(k)]
+
+    def dist(a, b):
+        return 0.0 if a is None or b is None else math.hypot(a[0] - b[0], a[1] - b[1])
+
+    def gain(i, j):
+        # Invertir las posiciones i+1..j
+        a, b, c, d = tail(i), head(i + 1), tail(j), head(j + 1)
+        return dist(a, b) + dist(c, d) - dist(a, c) - dist(b, d)
+
+    for _ in range(TWO_OPT_PASSES):
+        improved = False
+        for i in range(-1, n - 1):
+            if time.monotonic() > deadline:
+                return order, flip
+            moves = set()
+            if i >= 0:
+                for q in neighbours[tail_id(i)]:
+                    if q < 0:
+                        break
+                    m = pos[q // 2]
+                    if (q % 2 == 1) != flip[m] and m != i:
+                        moves.add((min(i, m), max(i, m)))
+            for q in neighbours[head_id(i + 1)]:
+                if q < 0:
+                    break
+                m = pos[q // 2]
+                if (q % 2 == 0) != flip[m] and m - 1 != i:
+                    moves.add((min(i, m - 1), max(i, m - 1)))
+            best, best_gain = None, 1e-6
+            for move in moves:
+                g = gain(*move)
+                if g > best_gain and reversible[order[move[0] + 1:move[1] + 1]].all():
+                    best, best_gain = move, g
+            if best:
+                lo, hi = best[0] + 1, best[1] + 1
+                order[lo:hi] = order[lo:hi][::-1]
+                flip[lo:hi] = ~flip[lo:hi][::-1]
+                pos[order[lo:hi]] = np.arange(lo, hi)
+                improved = True
+        if not improved:
+            break
+    return order, flip
+
+
+def _reversed_block(data, x, y, block):
+    """Filas de un trazo recorrido al revés"""
+    t, m, u, e, _ = block
+    travel = data[t:t + 1].copy()
+    inside = np.arange(m, u)
+    points = np.concatenate(([t], inside))
+    px, py = x[points], y[points]
+    travel['x'] = px[-1]
+    travel['y'] = py[-1]
+    moves = data[inside[::-1]].copy()
+    moves['x'] = px[-2::-1]
+    moves['y'] = py[-2::-1]
+    rows = np.concatenate(([t], np.arange(t + 1, m), inside[::-1], np.arange(u, e + 1)))
+    return np.concatenate((travel, data[t + 1:m], moves, data[u:e + 1])), rows
+
+
+def _group_exit(program, x, y, end_row):
+    """Punto al que se viaja al salir de un grupo de trazos.
+
+    Devuelve (libre, punto): libre indica que lo que sigue al grupo no depende
+    de dónde termina (el siguiente movimiento es un posicionamiento con X e Y
+    con la pluma levantada, o no hay más movimientos).
+    """
+    data = program.data
+    op = data['op']
+    after = slice(end_row + 1, None)
+    moves = np.flatnonzero(program.is_moves()[after]) + end_row + 1
+    if not len(moves):
+        return True, None
+    nxt = moves[0]
+    between = slice(end_row + 1, nxt)
+    if (np.any((op[between] == OP_M300) & (data['s'][between] == PEN_DOWN_S))
+            or np.any(op[between] == OP_G92)
+            or np.isnan(data['x'][nxt]) or np.isnan(data['y'][nxt])):
+        return False, None
+    return True, (x[nxt], y[nxt])
+
+
+def optimize_travel(program, time_limit=TWO_OPT_TIME):
+    """Reordena los trazos para minimizar el recorrido con la pluma levantada.
+
+    Devuelve (programa, informe); el informe incluye las distancias y tiempos
+    con la pluma levantada antes y después.
+    """
+    before = path_stats(program)
+    report = {
+        'polylines': 0,
+        'reversed': 0,
+        'travel_before': before['pen_up_distance'],
+        'travel_after': before['pen_up_distance'],
+        'time_before': before['pen_up_time'],
+        'time_after': before['pen_up_time'],
+    }
+    data = program.data
+    # En modo relativo reordenar cambiaría las coordenadas de todo lo demás
+    if not isinstance(program, GCodeProgram) or np.any(data['op'] == OP_G91):
+        return program, report
+    groups = find_polylines(program)
+    if not groups:
+        return program, report
+
+    x, y = program.positions()
+    deadline = time.monotonic() + time_limit
+    pieces = []
+    sources = []
+    cursor = 0
+    for group in groups:
+        first = group[0][0]
+        pieces.append(data[cursor:first])
+        sources.append(np.arange(cursor, first))
+        cursor = group[-1][3] + 1
+        free, end = _group_exit(program, x, y, group[-1][3])
+        fixed = []
+        if not free:
+            # Lo que sigue depende de dónde termina el grupo: el último trazo no se mueve
+            fixed = [group[-1]]
+            group = group[:-1]
+            end = (x[fixed[0][0]], y[fixed[0][0]])
+        if group:
+            blocks = np.array([b[:4] for b in group])
+            starts = np.column_stack((x[blocks[:, 0]], y[blocks[:, 0]]))
+            ends = np.column_stack((x[blocks[:, 2] - 1], y[blocks[:, 2] - 1]))
+            reversible = np.array([b[4] for b in group])
+            origin = (x[first - 1], y[first - 1]) if first else (0.0, 0.0)
+            order, flip, points = _nearest_neighbour_tour(starts, ends, reversible, origin)
+            order, flip = _two_opt(order, flip, points, reversible, origin, end, deadline)
+            identity = np.arange(len(group))
+            unflipped = np.zeros(len(group), dtype=bool)
+            if (_tour_cost(order, flip.astype(np.intp), points, origin, end)
+                    >= _tour_cost(identity, unflipped.astype(np.intp), points, origin, end)):
+                order, flip = identity, unflipped
+            report['polylines'] += len(group)
+            report['reversed'] += int(flip.sum())
+        else:
+            order, flip = [], []
+        for block, flipped in list(zip((group[b] for b in order), flip)) + [(b, False) for b in fixed]:
+            t, _, _, e, _ = block
+            if flipped:
+                rows_data, rows = _reversed_block(data, x, y, block)
+                pieces.append(rows_data)
+                sources.append(rows)
+            else:
+                pieces.append(data[t:e + 1])
+                sources.append(np.arange(t, e + 1))
+    pieces.append(data[cursor:])
+    sources.append(np.arange(cursor, len(data)))
+
+    data = np.concatenate(pieces)
+    sources = np.concatenate(sources)
+    raw = {int(i): program.raw[int(sources[i])] for i in np.flatnonzero(data['op'] == OP_RAW)}
+    optimized = GCodeProgram(data, raw, program.decimals)
+    after = path_stats(optimized)
+    report['travel_after'] = after['pen_up_distance']
+    report['time_after'] = after['pen_up_time']
+    return optimized, report
+
+
+def _segment_distance(px, py, ax, ay, bx, by):
+    """Distancia de los puntos P a los segmentos AB"""
+    dx = bx - ax
+    dy = by - ay
+    length2 = dx * dx + dy * dy
+    t = np.divide((px - ax) * dx + (py - ay) * dy, length2,
+                  out=np.zeros_like(px), where=length2 > 0)
+    np.clip(t, 0.0, 1.0, out=t)
+    return np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def _rdp_keep(x, y, starts, ends, tolerance):
+    """Ramer-Douglas-Peucker sobre muchos tramos a la vez.
+
+    Cada iteración procesa con NumPy todos los tramos pendientes: busca el
+    punto interior más alejado de la cuerda y, si supera la tolerancia, lo
+    conserva y parte el tramo en dos.
+    """
+    keep = np.zeros(len(x), dtype=bool)
+    keep[starts] = True
+    keep[ends] = True
+    while len(starts):
+        inner = ends - starts - 1
+        active = inner > 0
+        starts, ends, inner = starts[active], ends[active], inner[active]
+        if not len(starts):
+            break
+        segment = np.repeat(np.arange(len(starts)), inner)
+        offsets = np.cumsum(inner) - inner
+        index = np.arange(inner.sum()) - offsets[segment] + starts[segment] + 1
+        dist = _segment_distance(x[index], y[index],
+                                 x[starts][segment], y[starts][segment],
+                                 x[ends][segment], y[ends][segment])
+        farthest = np.maximum.reduceat(dist, offsets)
+        # Primer punto de cada tramo que alcanza la distancia máxima
+        candidates = np.flatnonzero(dist == farthest[segment])
+        _, first = np.unique(segment[candidates], return_index=True)
+        split_at = index[candidates[first]]
+        split = farthest > tolerance
+        keep[split_at[split]] = True
+        starts, ends = (np.concatenate((starts[split], split_at[split])),
+                        np.concatenate((split_at[split], ends[split])))
+    return keep
+
+
+def simplify_paths(program, tolerance):
+    """Simplifica los tramos de G1 con la pluma bajada.
+
+    Solo se eliminan filas G1 dentro de un tramo continuo con la pluma
+    bajada; M300, G4 y cualquier otra orden cortan el tramo y nunca se tocan.
+    Devuelve (programa, informe) con las líneas y bytes eliminados.
+    """
+    report = {'lines_removed': 0, 'bytes_removed': 0}
+    data = program.data
+    n = len(data)
+    if not isinstance(program, GCodeProgram) or not n or tolerance < 0:
+        return program, report
+    # En modo relativo cada fila es un desplazamiento: quitarla acorta el trazo
+    if np.any(data['op'] == OP_G91):
+        return program, report
+
+    x, y = program.positions()
+    pen = np.zeros(n, dtype=bool)
+    pen[1:] = program.pen_states()[:-1]
+    has_xy = ~(np.isnan(data['x']) & np.isnan(data['y']))
+    candidate = (data['op'] == OP_G1) & has_xy & pen & np.isnan(data['z'])
+    if not candidate.any():
+        return program, report
+
+    # Tramos = secuencias de filas candidatas consecutivas
+    edges = np.diff(np.concatenate(([False], candidate, [False])).astype(np.int8))
+    run_first = np.flatnonzero(edges == 1)
+    run_last = np.flatnonzero(edges == -1) - 1
+    # Puntos de cada tramo: la posición previa a la primera fila y las de cada fila
+    size = run_last - run_first + 2
+    run = np.repeat(np.arange(len(run_first)), size)
+    offsets = np.cumsum(size) - size
+    rows = np.arange(size.sum()) - offsets[run] + run_first[run] - 1
+    px, py = x[rows], y[rows]
+
+    # Extremos de cada tramo y filas que cambian el avance: siempre se conservan
+    forced = np.zeros(len(rows), dtype=bool)
+    forced[offsets] = True
+    forced[offsets + size - 1] = True
+    feeds = program.feeds()
+    changes_feed = np.zeros(n, dtype=bool)
+    changes_feed[1:] = ~np.isnan(data['f'][1:]) & (feeds[1:] != feeds[:-1])
+    forced |= changes_feed[rows]
+    fixed = np.flatnonzero(forced)
+    same_run = run[fixed[:-1]] == run[fixed[1:]]
+    keep = _rdp_keep(px, py, fixed[:-1][same_run], fixed[1:][same_run], max(tolerance, 1e-9))
+
+    point_is_row = np.ones(len(rows), dtype=bool)
+    point_is_row[offsets] = False
+    removed = rows[point_is_row & ~keep]
+    if not len(removed):
+        return program, report
+    report['lines_removed'] = int(len(removed))
+    report['bytes_removed'] = int(program.wire_lengths()[removed].sum())
+
+    # Las filas que quedan llevan X e Y explícitas: la anterior puede desaparecer
+    kept_rows = rows[point_is_row & keep]
+    data = data.copy()
+    for word, values in (('x', x), ('y', y)):
+        column = data[word]
+        missing = kept_rows[np.isnan(column[kept_rows])]
+        column[missing] = values[missing]
+    mask = np.ones(n, dtype=bool)
+    mask[removed] = False
+    simplified = GCodeProgram(data, program.raw, program.decimals).take(np.flatnonzero(mask))
+    return simplified, report
+
+
+def wire_bytes(program):
+    """Bytes que ocupa el programa en el puerto serie (incluido el \\n de cada línea)"""
+    return int(program.wire_lengths().sum())
+
+
+def _last_set(mask):
+    """Índice de la última fila hasta la anterior (incluida) en la que mask es cierto"""
+    index = np.maximum.accumulate(np.where(mask, np.arange(len(mask)), -1))
+    return np.concatenate(([-1], index[:-1]))
+
+
+def compact_program(program, decimals=FIRMWARE_DECIMALS):
+    """Formato compacto para el puerto serie.
+
+    Quita comentarios y espacios, recorta los números (sin ceros sobrantes y
+    con como mucho `decimals` decimales) y omite las palabras modales que
+    repiten el estado actual: F igual al avance vigente y X o Y iguales a la
+    posición actual en G0/G1 (siempre queda al menos una coordenada). G0/G1
+    no se omiten porque CNC_code.ino no tiene modos G: ignora las líneas que
+    no empiezan por una orden. Devuelve (programa, informe).
+    """
+    report = {'bytes_before': 0, 'bytes_after': 0, 'equivalent': True}
+    data = program.data
+    n = len(data)
+    if not isinstance(program, GCodeProgram) or not n:
+        return program, report
+    op = data['op']
+    present = {word: ~np.isnan(data[word.lower()]) for word in WORDS}
+    raw = op == OP_RAW
+    # Tras una línea sin compilar, G90, G91 o G92 no se sabe el estado de la máquina
+    reset = raw | (op == OP_G90) | (op == OP_G91) | (op == OP_G92)
+    last_reset = _last_set(reset)
+    moves = program.is_moves()
+
+    emit = np.zeros(n, dtype=np.uint8)
+    for bit, word in enumerate(WORDS):
+        emit |= present[word].astype(np.uint8) << bit
+
+    # F que repite el avance vigente
+    f = data['f']
+    last_f = _last_set(present['F'])
+    repeated_f = present['F'] & (last_f > last_reset) & (f == f[np.maximum(last_f, 0)])
+    emit[repeated_f] &= ~np.uint8(1 << WORDS.index('F'))
+
+    # X/Y que repiten la posición actual en movimientos absolutos
+    repeated = {}
+    for word in ('X', 'Y'):
+        column = data[word.lower()]
+        setter = moves & present[word]
+        last = _last_set(setter)
+        repeated[word] = (moves & present[word] & (last > last_reset)
+                          & (column == column[np.maximum(last, 0)]))
+    drop_x = repeated['X'] & present['Y'] & ~repeated['Y']
+    drop_y = repeated['Y'] & (present['X'] & ~drop_x)
+    emit[drop_x] &= ~np.uint8(1 << WORDS.index('X'))
+    emit[drop_y] &= ~np.uint8(1 << WORDS.index('Y'))
+
+    compact_raw = {row: compact_text(text) for row, text in program.raw.items()}
+    compacted = GCodeProgram(data, compact_raw, min(program.decimals, decimals), emit)
+    report['bytes_before'] = wire_bytes(program)
+    report['bytes_after'] = wire_bytes(compacted)
+    report['equivalent'] = check_equivalence(program, compacted) is None
+    return compacted, report
+
+
+def check_equivalence(original, compacted):
+    """Comprueba que el texto compacto vuelve a dar el mismo programa.
+
+    Recompila las líneas compactas y compara fila a fila la orden, la
+    posición resultante, el avance vigente y los valores S/P/Z, con la
+    tolerancia del redondeo aplicado. Devuelve None si son equivalentes o
+    el índice de la primera fila distinta.
+    """
+    parsed = GCodeProgram.from_lines(iter(compacted))
+    if len(parsed) != len(original):
+        return min(len(parsed), len(original))
+    a, b = original.data, parsed.data
+    tolerance = 0.5 * 10.0 ** -compacted.decimals + 1e-6
+    different = a['op'] != b['op']
+    for (ax, bx) in zip(original.positions(), parsed.positions()):
+        different |= np.abs(ax - bx) > tolerance
+    different |= np.abs(original.feeds() - parsed.feeds()) > tolerance
+    for word in ('s', 'p', 'z'):
+        va, vb = a[word], b[word]
+        different |= (np.isnan(va) != np.isnan(vb)) | (np.abs(va - vb) > tolerance)
+    for row, text in original.raw.items():
+        different[row] |= compact_text(text).upper() != parsed.raw.get(row, compacted.raw[row]).upper()
+    rows = np.flatnonzero(different)
+    return int(rows[0]) if len(rows) else None
@@ -0,0 +1,213 @@
+"""Vista previa del recorrido con matplotlib.
+
+Toolpath extrae del programa compilado los tramos G0/G1 (con pluma bajada
+o levantada) como arrays de NumPy y los reduce al nivel de detalle de la
+vista: los puntos que caen en el mismo píxel que el anterior se saltan y
+los tramos fuera de la vista se descartan, así que lo que se dibuja depende
+del tamaño de la ventana y no del programa.
+
+ToolpathPreview dibuja el resultado en unos ejes con LineCollection (una
+polilínea por cada serie de tramos seguidos del mismo tipo) y
+superpone el avance del trabajo: los tramos nuevos y el marcador de la
+posición actual se pintan por blitting sobre la última imagen, sin volver
+a dibujar toda la figura. No depende de Tk: recibe una Figure que ya tiene
+su canvas (FigureCanvasTkAgg en la interfaz).
+"""
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.patches import Rectangle
+
+from gcode_estimate import FIRMWARE_SETTINGS
+
+DRAW_COLOR = '#1f4e9c'
+TRAVEL_COLOR = '#c8c8c8'
+DONE_COLOR = '#d62728'
+BED_COLOR = '#f4f4f4'
+
+
+class Toolpath:
+    """Puntos por los que pasa la máquina y estado de la pluma en cada tramo"""
+
+    def __init__(self, program, start=(0.0, 0.0)):
+        x, y = program.positions(start)
+        rows = np.flatnonzero(program.is_moves())
+        pen = program.pen_states()
+        # La pluma durante un movimiento es la que dejó la fila anterior
+        before = np.concatenate(([False], pen[:-1]))
+        points = np.column_stack((np.concatenate(([start[0]], x[rows])),
+                                  np.concatenate(([start[1]], y[rows]))))
+        # Los movimientos que no cambian la posición no dibujan nada
+        moved = np.any(points[1:] != points[:-1], axis=1)
+        self.points = points[np.concatenate(([True], moved))]
+        self.drawing = before[rows][moved]   # Pluma bajada en el tramo i (points[i] → points[i+1])
+        self.rows = rows[moved]              # Fila del programa que termina el tramo i
+
+    def __len__(self):
+        return len(self.drawing)
+
+    def bounds(self):
+        """(xmin, xmax, ymin, ymax) de todo el recorrido"""
+        if not len(self):
+            return None
+        low = self.points.min(axis=0)
+        high = self.points.max(axis=0)
+        return low[0], high[0], low[1], high[1]
+
+    def segments_done(self, index):
+        """Tramos completados cuando se han ejecutado las filas anteriores a index"""
+        return int(np.searchsorted(self.rows, index))
+
+    def decimate(self, pixel_width, pixel_height, view=None):
+        """Recorrido simplificado con un error de como mucho un píxel.
+
+        Devuelve (puntos (k, 2), pluma bajada en cada tramo (k-1,), índice
+        en self.points del punto final de cada tramo, tramo visible en la vista).
+        """
+        points = self.points
+        cell = np.array([max(pixel_width, 1e-12), max(pixel_height, 1e-12)])
+        pixels = np.floor(points / cell).astype(np.int64)
+        keep = np.ones(len(points), dtype=bool)
+        keep[1:] = np.any(pixels[1:] != pixels[:-1], axis=1)
+        # Los cambios de pluma se conservan: así cada tramo resultante tiene un solo estado
+        keep[np.flatnonzero(self.drawing[1:] != self.drawing[:-1]) + 1] = True
+        keep[-1] = True
+        kept = np.flatnonzero(keep)
+        start, end = points[kept[:-1]], points[kept[1:]]
+        visible = np.ones(len(kept) - 1, dtype=bool)
+        if view is not None:
+            x0, x1, y0, y1 = view
+            visible = ((np.maximum(start[:, 0], end[:, 0]) >= min(x0, x1))
+                       & (np.minimum(start[:, 0], end[:, 0]) <= max(x0, x1))
+                       & (np.maximum(start[:, 1], end[:, 1]) >= min(y0, y1))
+                       & (np.minimum(start[:, 1], end[:, 1]) <= max(y0, y1)))
+        return points[kept], self.drawing[kept[:-1]], kept[1:], visible
+
+
+def polylines(points, selected):
+    """Agrupa los tramos seleccionados (points[j] → points[j+1]) en polilíneas"""
+    edges = np.diff(np.concatenate(([False], selected, [False])).astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return [points[a:b + 1] for a, b in zip(starts, ends)]
+
+
+class ToolpathPreview:
+    """Recorrido y avance del trabajo sobre unos ejes de matplotlib"""
+
+    def __init__(self, figure):
+        self.figure = figure
+        self.canvas = figure.canvas
+        self.ax = figure.add_subplot(111)
+        self.ax.set_aspect('equal', adjustable='datalim')
+        self.ax.add_patch(Rectangle(
+            (FIRMWARE_SETTINGS['Xmin'], FIRMWARE_SETTINGS['Ymin']),
+            FIRMWARE_SETTINGS['Xmax'] - FIRMWARE_SETTINGS['Xmin'],
+            FIRMWARE_SETTINGS['Ymax'] - FIRMWARE_SETTINGS['Ymin'],
+            facecolor=BED_COLOR, edgecolor='#999999', linewidth=0.5))
+        self.travel = LineCollection([], colors=TRAVEL_COLOR, linewidths=0.5)
+        self.draw = LineCollection([], colors=DRAW_COLOR, linewidths=0.8)
+        self.done = LineCollection([], colors=DONE_COLOR, linewidths=1.2)
+        # Los artistas "animated" no entran en el dibujo normal: se pintan por blitting
+        self.new_done = LineCollection([], colors=DONE_COLOR, linewidths=1.2, animated=True)
+        for collection in (self.travel, self.draw, self.done, self.new_done):
+            self.ax.add_collection(collection)
+        self.marker, = self.ax.plot([], [], 'o', color=DONE_COLOR, markersize=5, animated=True)
+        self.toolpath = None
+        self.progress = 0          # Tramos completados
+        self._segments = None      # Resultado de decimate() para la vista actual
+        self._view = None          # Vista y tamaño con los que se calculó
+        self._done_stale = False   # self.done no incluye todo el avance
+        self._background = None    # Imagen de los ejes para el blitting
+        self.ax.callbacks.connect('xlim_changed', self._limits_changed)
+        self.ax.callbacks.connect('ylim_changed', self._limits_changed)
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+        self.canvas.mpl_connect('resize_event', self._limits_changed)
+
+    def set_program(self, program):
+        """Muestra el recorrido de un programa compilado (None para vaciar)"""
+        self.toolpath = Toolpath(program) if program is not None else None
+        self.progress = 0
+        bounds = self.toolpath.bounds() if self.toolpath is not None else None
+        if bounds is None:
+            bounds = (FIRMWARE_SETTINGS['Xmin'], FIRMWARE_SETTINGS['Xmax'],
+                      FIRMWARE_SETTINGS['Ymin'], FIRMWARE_SETTINGS['Ymax'])
+        x0, x1, y0, y1 = bounds
+        margin = max(x1 - x0, y1 - y0, 1.0) * 0.03
+        self._view = None
+        self.ax.set_xlim(x0 - margin, x1 + margin)
+        self.ax.set_ylim(y0 - margin, y1 + margin)
+        self.update_lod()
+        self.canvas.draw_idle()
+
+    def _limits_changed(self, *args):
+        self.update_lod()
+
+    def update_lod(self):
+        """Recalcula los tramos visibles para la vista y el tamaño actuales"""
+        if self.toolpath is None or not len(self.toolpath):
+            self._segments = None
+            for collection in (self.travel, self.draw, self.done):
+                collection.set_segments([])
+            return
+        x0, x1 = self.ax.get_xlim()
+        y0, y1 = self.ax.get_ylim()
+        width = max(self.ax.bbox.width, 1.0)
+        height = max(self.ax.bbox.height, 1.0)
+        view = (x0, x1, y0, y1, width, height)
+        if view == self._view:
+            return
+        self._view = view
+        points, drawing, end_index, visible = self.toolpath.decimate(
+            abs(x1 - x0) / width, abs(y1 - y0) / height, (x0, x1, y0, y1))
+        self._segments = points, drawing & visible, end_index
+        self.draw.set_segments(polylines(points, drawing & visible))
+        self.travel.set_segments(polylines(points, ~drawing & visible))
+        self._update_done()
+
+    def _update_done(self):
+        if self._segments is None:
+            return
+        points, drawing, end_index = self._segments
+        self.done.set_segments(polylines(points, drawing & (end_index <= self.progress)))
+        self._done_stale = False
+
+    def set_progress(self, index):
+        """Marca como hechas las filas anteriores a index (gcode_index)"""
+        if self.toolpath is None:
+            return
+        progress = self.toolpath.segments_done(index)
+        if progress == self.progress:
+            return
+        previous, self.progress = self.progress, progress
+        if progress < previous or self._background is None or self._segments is None:
+            # Retroceso (nuevo envío) o aún sin imagen: dibujo completo
+            self._update_done()
+            self.canvas.draw_idle()
+            return
+        # Solo se pintan los tramos completados desde la última vez
+        points, drawing, end_index = self._segments
+        new = drawing & (end_index > previous) & (end_index <= progress)
+        self.new_done.set_segments(polylines(points, new))
+        self.canvas.restore_region(self._background)
+        self.ax.draw_artist(self.new_done)
+        self._background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self._done_stale = True  # self.done se pone al día en el próximo dibujo completo
+        self._draw_marker()
+        self.canvas.blit(self.ax.bbox)
+
+    def _draw_marker(self):
+        if self.toolpath is not None and len(self.toolpath):
+            x, y = self.toolpath.points[min(self.progress, len(self.toolpath))]
+            self.marker.set_data([x], [y])
+            self.ax.draw_artist(self.marker)
+
+    def _on_draw(self, event):
+        if self._done_stale:
+            # El dibujo se hizo sin el avance pintado por blitting
+            self._update_done()
+            self.canvas.draw_idle()
+            return
+        self._background = self.canvas.copy_from_bbox(self.ax.bbox)
+        if self.progress:
+            self._draw_marker()
+            self.canvas.blit(self.ax.bbox)
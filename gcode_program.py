@@ -0,0 +1,525 @@
+"""Representación compacta de un programa G-code.
+
+Cada línea útil del archivo se compila una sola vez en una fila de un array
+estructurado de NumPy (código de operación, palabras X/Y/Z/F/S/P y número de
+línea en el archivo original). El texto que se envía por el puerto serie se
+genera a partir de esas columnas solo cuando hace falta.
+"""
+import bisect
+import mmap
+import os
+import re
+import threading
+from array import array
+
+import numpy as np
+
+# Códigos de operación: las órdenes G se guardan con su número y las M con
+# M_BASE + número. Las líneas que no encajan en el formato se guardan tal cual.
+M_BASE = 1000
+OP_RAW = 0xFFFF
+
+OP_G0 = 0
+OP_G1 = 1
+OP_G4 = 4
+OP_G20 = 20
+OP_G21 = 21
+OP_G90 = 90
+OP_G91 = 91
+OP_G92 = 92
+OP_M300 = M_BASE + 300
+OP_M114 = M_BASE + 114
+
+# Valores de S de M300 con los que el firmware baja y sube la pluma
+PEN_DOWN_S = 30
+PEN_UP_S = 50
+
+# Palabras con valor que se guardan en columnas (NaN = palabra ausente)
+WORDS = ('X', 'Y', 'Z', 'F', 'S', 'P')
+
+PROGRAM_DTYPE = np.dtype([
+    ('op', np.uint16),
+    ('x', np.float32),
+    ('y', np.float32),
+    ('z', np.float32),
+    ('f', np.float32),
+    ('s', np.float32),
+    ('p', np.float32),
+    ('line', np.uint32),
+])
+
+# Máximo de decimales al regenerar el texto (el firmware usa float de 32 bits)
+MAX_DECIMALS = 4
+
+_COMMENT_RE = re.compile(r'\([^)]*\)|;.*')
+_WORD_RE = re.compile(r'\s*([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+
+
+def ffill(values, mask, initial=0.0):
+    """Propaga hacia delante values[i] donde mask[i] es cierto (initial al principio)"""
+    index = np.where(mask, np.arange(1, len(values) + 1), 0)
+    np.maximum.accumulate(index, out=index)
+    return np.concatenate(([initial], values))[index]
+
+
+def format_number(value, decimals):
+    """Número con el mínimo de caracteres: sin ceros sobrantes ni cero inicial"""
+    text = f"{value:.{decimals}f}"
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    if text.startswith('0.'):
+        text = text[1:]
+    elif text.startswith('-0.'):
+        text = '-' + text[2:]
+    if text in ('', '-0', '-'):
+        text = '0'
+    return text
+
+
+def _digits(values):
+    """Cifras de la parte entera (enteros >= 0; el 0 tiene una cifra)"""
+    digits = np.ones(len(values), dtype=np.int64)
+    for power in range(1, 19):
+        digits += values >= 10 ** power
+    return digits
+
+
+def number_lengths(values, decimals, compact=False):
+    """Longitud de format_number (compact) o de "%.{decimals}f" para cada valor"""
+    values = np.asarray(values, dtype=np.float64)
+    scale = 10 ** decimals
+    scaled = np.rint(np.abs(values) * scale).astype(np.int64)
+    integer, fraction = np.divmod(scaled, scale)
+    if not compact:
+        return np.signbit(values) + _digits(integer) + (decimals + 1 if decimals else 0)
+    trailing = np.zeros(len(values), dtype=np.int64)
+    for power in range(1, decimals + 1):
+        trailing += (fraction % 10 ** power) == 0
+    has_fraction = fraction > 0
+    integer_length = np.where(integer > 0, _digits(integer), np.where(has_fraction, 0, 1))
+    negative = (values < 0) & (scaled > 0)
+    return negative + integer_length + np.where(has_fraction, 1 + decimals - trailing, 0)
+
+
+def compact_text(line):
+    """Quita comentarios y espacios de una línea (el firmware los descarta igualmente)"""
+    return ''.join(_COMMENT_RE.sub('', line).split())
+
+
+def opcode_name(op):
+    """Devuelve el nombre de la orden ("G1", "M300"...) de un código de operación"""
+    if op == OP_RAW:
+        return ""
+    if op >= M_BASE:
+        return f"M{op - M_BASE}"
+    return f"G{op}"
+
+
+def is_program_line(line):
+    """Indica si una línea (ya sin espacios en los extremos) se envía a la máquina"""
+    return bool(line) and not line.startswith(';') and not line.startswith('(')
+
+
+def parse_line(line):
+    """Descompone una línea en (opcode, {palabra: valor}, decimales).
+
+    Devuelve None si la línea no es una única orden G/M seguida de palabras
+    X/Y/Z/F/S/P sin repetir; esas líneas se conservan como texto.
+    """
+    code = _COMMENT_RE.sub('', line).upper()
+    pos = 0
+    op = None
+    values = {}
+    decimals = 0
+    for match in _WORD_RE.finditer(code):
+        if match.start() != pos:
+            return None
+        pos = match.end()
+        letter, number = match.groups()
+        if op is None:
+            if letter not in 'GM' or not number.isdigit():
+                return None
+            op = int(number) + (M_BASE if letter == 'M' else 0)
+            if op >= OP_RAW:
+                return None
+            continue
+        if letter not in WORDS or letter in values:
+            return None
+        values[letter] = float(number)
+        if '.' in number:
+            decimals = max(decimals, len(number) - number.index('.') - 1)
+    if op is None or code[pos:].strip():
+        return None
+    return op, values, decimals
+
+
+class GCodeProgram:
+    """Programa G-code compilado en columnas.
+
+    Se comporta como una secuencia de líneas de texto: len(), índices e
+    iteración devuelven el texto que se envía a la máquina.
+    """
+
+    def __init__(self, data, raw=None, decimals=2, emit=None):
+        self.data = data            # Array estructurado con PROGRAM_DTYPE
+        self.raw = raw or {}        # fila -> texto de las líneas no compiladas
+        self.decimals = decimals    # Decimales con los que se regeneran los valores
+        # Formato compacto: bits (1 << posición en WORDS) de las palabras que se
+        # envían en cada fila. None = formato normal con todas las palabras.
+        self.emit = emit
+
+    @classmethod
+    def from_lines(cls, lines):
+        """Compila un iterable de líneas de texto"""
+        op = array('H')
+        columns = {word: array('f') for word in WORDS}
+        source = array('I')
+        raw = {}
+        decimals = 0
+        nan = float('nan')
+
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not is_program_line(line):
+                continue
+            parsed = parse_line(line)
+            if parsed is None:
+                raw[len(op)] = line
+                op.append(OP_RAW)
+                values = {}
+            else:
+                code, values, line_decimals = parsed
+                op.append(code)
+                decimals = max(decimals, line_decimals)
+            for word, column in columns.items():
+                column.append(values.get(word, nan))
+            source.append(number)
+
+        data = np.empty(len(op), dtype=PROGRAM_DTYPE)
+        data['op'] = np.frombuffer(op, dtype=np.uint16)
+        for word, column in columns.items():
+            data[word.lower()] = np.frombuffer(column, dtype=np.float32)
+        data['line'] = np.frombuffer(source, dtype=np.uint32)
+        return cls(data, raw, min(decimals, MAX_DECIMALS))
+
+    @classmethod
+    def from_file(cls, filename):
+        """Compila un archivo G-code"""
+        with open(filename, 'r') as f:
+            return cls.from_lines(f)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __bool__(self):
+        return len(self.data) > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(np.arange(len(self.data))[index])
+        return self.line_text(index)
+
+    def take(self, rows):
+        """Devuelve un programa nuevo con las filas indicadas, en ese orden.
+
+        El resultado usa el formato normal: las palabras omitidas por el
+        formato compacto dependen de las filas anteriores.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        data = self.data[rows]
+        raw = {}
+        if self.raw:
+            for new in np.flatnonzero(data['op'] == OP_RAW):
+                raw[int(new)] = self.raw[int(rows[new])]
+        return GCodeProgram(data, raw, self.decimals)
+
+    def has_line(self, index):
+        """Indica si el programa tiene la línea index"""
+        return index < len(self.data)
+
+    def close(self):
+        """Libera los recursos del programa (nada que hacer en memoria)"""
+
+    def __iter__(self):
+        for index in range(len(self.data)):
+            yield self.line_text(index)
+
+    def line_text(self, index):
+        """Genera el texto de la línea que se envía por el puerto serie"""
+        row = self.data[index]
+        op = int(row['op'])
+        if op == OP_RAW:
+            if index < 0:
+                index += len(self.data)
+            return self.raw[index]
+        words = [opcode_name(op)]
+        if self.emit is not None:
+            emit = int(self.emit[index])
+            for bit, word in enumerate(WORDS):
+                if emit & (1 << bit):
+                    words.append(word + format_number(row[word.lower()], self.decimals))
+            return "".join(words)
+        for word in WORDS:
+            value = row[word.lower()]
+            if value == value:  # no es NaN
+                words.append(f"{word}{value:.{self.decimals}f}")
+        return " ".join(words)
+
+    def is_moves(self):
+        """Máscara de las filas G0/G1"""
+        op = self.data['op']
+        return (op == OP_G0) | (op == OP_G1)
+
+    def positions(self, start=(0.0, 0.0)):
+        """Posición X, Y (float64) de la máquina tras cada fila.
+
+        Tiene en cuenta G0/G1 y G92; con G91 acumula los desplazamientos.
+        """
+        data = self.data
+        op = data['op']
+        if np.any(op == OP_G91):
+            return self._relative_positions(start)
+        moves = self.is_moves()
+        coords = []
+        for word, initial in zip(('x', 'y'), start):
+            values = data[word].astype(np.float64)
+            mask = (moves | (op == OP_G92)) & ~np.isnan(values)
+            coords.append(ffill(values, mask, initial))
+        return coords[0], coords[1]
+
+    def _relative_positions(self, start):
+        # Caso poco habitual (G91): se recorre fila a fila
+        data = self.data
+        x = np.empty(len(data))
+        y = np.empty(len(data))
+        px, py = start
+        relative = False
+        for i, (op, vx, vy) in enumerate(zip(data['op'], data['x'], data['y'])):
+            if op == OP_G90:
+                relative = False
+            elif op == OP_G91:
+                relative = True
+            elif op in (OP_G0, OP_G1):
+                if vx == vx:
+                    px = px + vx if relative else float(vx)
+                if vy == vy:
+                    py = py + vy if relative else float(vy)
+            elif op == OP_G92:
+                px = float(vx) if vx == vx else px
+                py = float(vy) if vy == vy else py
+            x[i] = px
+            y[i] = py
+        return x, y
+
+    def pen_states(self):
+        """Estado de la pluma tras cada fila (True = bajada, según M300 S30/S50)"""
+        data = self.data
+        pen = data['op'] == OP_M300
+        s = data['s']
+        mask = pen & ((s == PEN_DOWN_S) | (s == PEN_UP_S))
+        return ffill(s == PEN_DOWN_S, mask, False).astype(bool)
+
+    def feeds(self, initial=0.0):
+        """Avance F (mm/min) vigente en cada fila"""
+        f = self.data['f'].astype(np.float64)
+        return ffill(f, ~np.isnan(f), initial)
+
+    def wire_lengths(self):
+        """Bytes que ocupa cada línea en el puerto serie (incluido el \\n), sin generar el texto"""
+        data = self.data
+        op = data['op'].astype(np.int64)
+        raw = op == OP_RAW
+        number = np.where(op >= M_BASE, op - M_BASE, op)
+        lengths = 1 + _digits(np.where(raw, 0, number)) + 1  # Letra, número y \n
+        words = np.zeros(len(data), dtype=np.int64)
+        for bit, word in enumerate(WORDS):
+            values = data[word.lower()]
+            if self.emit is not None:
+                present = (self.emit & (1 << bit)) > 0
+            else:
+                present = ~np.isnan(values)
+            if not present.any():
+                continue
+            size = number_lengths(np.where(present, values, 0.0), self.decimals, self.emit is not None)
+            lengths += np.where(present, 1 + size, 0)
+            words += present
+        if self.emit is None:
+            lengths += words  # Espacio delante de cada palabra
+        for row, text in self.raw.items():
+            lengths[row] = len(text) + 1
+        return lengths
+
+    def source_line(self, index):
+        """Número de línea (desde 1) en el archivo original"""
+        return int(self.data['line'][index])
+
+    @property
+    def nbytes(self):
+        """Memoria aproximada ocupada por el programa"""
+        return self.data.nbytes + sum(len(text) for text in self.raw.values())
+
+
+# Tamaño a partir del cual load_gcode usa LazyGCodeFile en lugar de compilar
+LAZY_THRESHOLD = 32 * 1024 * 1024
+
+# Bytes que se examinan de una vez al buscar saltos de línea
+INDEX_CHUNK = 8 * 1024 * 1024
+
+# Bytes que se examinan de una vez al buscar hacia atrás (lines_before)
+SCAN_CHUNK = 1024 * 1024
+
+
+class LazyGCodeFile:
+    """Archivo G-code muy grande leído bajo demanda mediante mmap.
+
+    Un hilo en segundo plano recorre el archivo una sola vez y guarda el
+    desplazamiento de cada línea útil. Las líneas se pueden pedir mientras
+    el índice todavía se está construyendo: has_line() espera solo hasta que
+    la línea pedida está indexada, así que un trabajo puede empezar enseguida.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.error = None
+        self._file = open(filename, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._chunks = []     # Arrays de desplazamientos de inicio de línea
+        self._bounds = []     # Número acumulado de líneas al final de cada array
+        self._count = 0
+        self._done = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._build_index, daemon=True)
+        self._thread.start()
+
+    def _build_index(self):
+        """Construye el índice de desplazamientos en una sola pasada"""
+        try:
+            size = len(self._mm)
+            data = np.frombuffer(self._mm, dtype=np.uint8) if size else None
+            pending = np.zeros(1, dtype=np.int64)  # La primera línea empieza en 0
+            for offset in range(0, size, INDEX_CHUNK):
+                if self._closed:
+                    break
+                chunk = data[offset:offset + INDEX_CHUNK]
+                newlines = np.flatnonzero(chunk == 10) + (offset + 1)
+                starts = np.concatenate((pending, newlines[newlines < size]))
+                pending = starts[:0]
+                self._add_lines(data, starts)
+                del chunk
+            del data
+        except Exception as e:
+            self.error = e
+        with self._cond:
+            self._done = True
+            self._cond.notify_all()
+
+    def _add_lines(self, data, starts):
+        """Filtra las líneas vacías y de comentario y las añade al índice"""
+        if not len(starts):
+            return
+        first = data[starts]
+        keep = ~np.isin(first, np.frombuffer(b"\n\r(;", dtype=np.uint8))
+        # Las líneas que empiezan con espacios se comprueban una a una
+        for i in np.flatnonzero(keep & np.isin(first, np.frombuffer(b" \t", dtype=np.uint8))):
+            keep[i] = is_program_line(self._read_line(int(starts[i])))
+        starts = starts[keep].astype(np.uint64)
+        if not len(starts):
+            return
+        with self._cond:
+            self._chunks.append(starts)
+            self._count += len(starts)
+            self._bounds.append(self._count)
+            self._cond.notify_all()
+
+    def _read_line(self, start):
+        end = self._mm.find(b"\n", start)
+        if end < 0:
+            end = len(self._mm)
+        return self._mm[start:end].decode('utf-8', errors='replace').strip()
+
+    @property
+    def indexing_done(self):
+        return self._done
+
+    def wait_indexed(self, timeout=None):
+        """Espera a que termine el indexado"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._done, timeout)
+
+    def has_line(self, index):
+        """Indica si existe la línea index, esperando a que se indexe si hace falta"""
+        with self._cond:
+            self._cond.wait_for(lambda: index < self._count or self._done)
+            return index < self._count
+
+    def __len__(self):
+        # Líneas indexadas hasta el momento
+        return self._count
+
+    def __bool__(self):
+        return self.has_line(0)
+
+    def __getitem__(self, index):
+        return self.line_text(index)
+
+    def __iter__(self):
+        index = 0
+        while self.has_line(index):
+            yield self.line_text(index)
+            index += 1
+
+    def _offset(self, index):
+        """Desplazamiento en el archivo del inicio de la línea index"""
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        chunk = bisect.bisect_right(self._bounds, index)
+        first = self._bounds[chunk - 1] if chunk else 0
+        return int(self._chunks[chunk][index - first])
+
+    def line_text(self, index):
+        """Lee del archivo el texto de la línea que se envía por el puerto serie"""
+        return self._read_line(self._offset(index))
+
+    def lines_before(self, index, *patterns):
+        """Líneas anteriores a la línea index que contienen algún patrón, de la más cercana a la primera
+
+        Los patrones son expresiones regulares de bytes; conviene que empiecen
+        por un literal (b'G9[01]' y no b'[Gg]0*9'), que re busca mucho más
+        deprisa. El archivo se recorre hacia atrás por trozos sin compilarlo,
+        así que encontrar el último valor de una palabra cuesta poco aunque
+        index esté a millones de líneas del principio. También salen líneas
+        de comentario: el llamador debe analizarlas.
+        """
+        end = self._offset(index) if self.has_line(index) else len(self._mm)
+        regexes = [re.compile(pattern) for pattern in patterns]
+        previous = None  # Inicio de la última línea devuelta
+        while end > 0:
+            # Cada trozo empieza al principio de una línea: ninguna coincidencia queda partida
+            start = max(end - SCAN_CHUNK, 0)
+            if start:
+                start = self._mm.rfind(b"\n", 0, start) + 1
+            found = sorted(match.start() for regex in regexes
+                           for match in regex.finditer(self._mm, start, end))
+            for position in reversed(found):
+                line_start = self._mm.rfind(b"\n", 0, position) + 1
+                if line_start != previous:
+                    previous = line_start
+                    yield self._read_line(line_start)
+            end = start
+
+    @property
+    def nbytes(self):
+        """Memoria ocupada por el índice (el archivo no se carga en memoria)"""
+        return 8 * self._count
+
+    def close(self):
+        """Detiene el indexado y libera el mmap"""
+        self._closed = True
+        self._thread.join()
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
@@ -0,0 +1,183 @@
+"""Reanudación de un programa a partir de una línea o de un punto guardado.
+
+resume_preamble() reconstruye con el programa compilado el estado modal que
+tendría la máquina antes de una fila (unidades, modo absoluto/relativo,
+último avance F, posición y pluma) y devuelve las pocas líneas que lo
+restablecen: pluma arriba, desplazamiento en vacío a la última posición y
+pluma abajo si hacía falta. Así no hay que repetir todo lo anterior. Con
+los archivos leídos bajo demanda, lazy_resume_preamble() busca hacia atrás
+solo las palabras necesarias en lugar de compilar todo lo anterior.
+
+Los puntos de reanudación son JSON pequeños, uno por archivo, con la
+última fila confirmada y una huella del programa procesado: si cambia el
+archivo o los ajustes de procesado, el punto deja de valer.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from gcode_cache import atomic_write
+from gcode_program import (GCodeProgram, MAX_DECIMALS, OP_G0, OP_G1, OP_G20, OP_G21, OP_G90,
+                           OP_G91, OP_G92, OP_M300, PEN_DOWN_S, PEN_UP_S, format_number,
+                           opcode_name, parse_line)
+
+# Cada cuánto (s) se guarda el punto de reanudación durante el streaming
+CHECKPOINT_INTERVAL = 5.0
+
+CHECKPOINT_VERSION = 1
+
+
+def _last_op(op, codes):
+    """Último de los códigos indicados que aparece en op, o None"""
+    rows = np.flatnonzero(np.isin(op, codes))
+    return int(op[rows[-1]]) if len(rows) else None
+
+
+def resume_preamble(program, index):
+    """Líneas que dejan la máquina como la dejarían las filas anteriores a index.
+
+    El desplazamiento se hace siempre con la pluma levantada y en absoluto;
+    el avance F vigente va en esa misma línea (el firmware no admite un G1
+    sin X ni Y) y, si el programa estaba en G91, se vuelve a G91 al final.
+    """
+    index = min(index, len(program))
+    if index <= 0:
+        return []
+    op = program.data['op'][:index]
+    x, y = program.positions()
+    return _preamble(_last_op(op, (OP_G20, OP_G21)), _last_op(op, (OP_G90, OP_G91)),
+                     x[index - 1], y[index - 1], program.feeds()[index - 1],
+                     program.pen_states()[index - 1], max(program.decimals, 2))
+
+
+def lazy_resume_preamble(lazy_file, index):
+    """resume_preamble() para un LazyGCodeFile, sin compilar las filas anteriores.
+
+    Cada palabra se busca hacia atrás desde index con las mismas reglas que
+    el programa compilado (solo cuentan las líneas que compila parse_line),
+    en mayúsculas y en minúsculas; no se reconocen G20/G21/G90/G91/M300
+    escritos con ceros a la izquierda (G091). Devuelve None si el programa
+    está en G91: la posición solo se obtiene sumando todos los
+    desplazamientos anteriores.
+    """
+    if index <= 0:
+        return []
+
+    def last(pattern, value):
+        return _last_value(lazy_file, index, pattern, value)
+
+    def word(letter, ops=None):
+        return lambda op, values: values.get(letter) if ops is None or op in ops else None
+
+    distance = last(rb'G9[01]', lambda op, values: op if op in (OP_G90, OP_G91) else None)
+    if distance == OP_G91:
+        return None
+    units = last(rb'G2[01]', lambda op, values: op if op in (OP_G20, OP_G21) else None)
+    # Como positions(): la posición la fijan G0/G1 y G92
+    x = last(rb'X', word('X', (OP_G0, OP_G1, OP_G92)))
+    y = last(rb'Y', word('Y', (OP_G0, OP_G1, OP_G92)))
+    feed = last(rb'F', word('F'))
+    # Como pen_states(): solo M300 S30/S50
+    pen = last(rb'M300', lambda op, values: values['S'] == PEN_DOWN_S
+               if op == OP_M300 and values.get('S') in (PEN_DOWN_S, PEN_UP_S) else None)
+    return _preamble(units, distance, x or 0.0, y or 0.0, feed or 0.0, bool(pen), MAX_DECIMALS)
+
+
+def machine_position(program, index):
+    """Posición (X, Y) que contesta M114 tras ejecutar las filas anteriores a index
+
+    Como gcode_estimate.firmware_positions(): solo la cambian G0/G1, porque el firmware no
+    conoce G92 ni G91. Cada eje es None si ninguna de esas filas lo fija.
+    """
+    if isinstance(program, GCodeProgram):
+        data = program.data[:index]
+        moves = (data['op'] == OP_G0) | (data['op'] == OP_G1)
+        position = []
+        for word in ('x', 'y'):
+            rows = np.flatnonzero(moves & ~np.isnan(data[word]))
+            position.append(round(float(data[word][rows[-1]]), MAX_DECIMALS) if len(rows) else None)
+        return tuple(position)
+
+    def move_word(letter):
+        return lambda op, values: values.get(letter) if op in (OP_G0, OP_G1) else None
+
+    return (_last_value(program, index, rb'X', move_word('X')),
+            _last_value(program, index, rb'Y', move_word('Y')))
+
+
+def _last_value(lazy_file, index, pattern, value):
+    """Primer value(op, palabras) no None de las líneas anteriores a index con pattern, hacia atrás"""
+    for text in lazy_file.lines_before(index, pattern, pattern.lower()):
+        parsed = parse_line(text)
+        if parsed is not None:
+            found = value(parsed[0], parsed[1])
+            if found is not None:
+                return found
+    return None
+
+
+def _preamble(units, distance, x, y, feed, pen, decimals):
+    lines = [f"M300 S{PEN_UP_S}"]
+    if units is not None:
+        lines.append(opcode_name(units))
+    if distance == OP_G91:
+        lines.append(opcode_name(OP_G90))
+    travel = (f"{opcode_name(OP_G0)} X{format_number(x, decimals)} "
+              f"Y{format_number(y, decimals)}")
+    if feed > 0:
+        travel += f" F{format_number(feed, decimals)}"
+    lines.append(travel)
+    if distance == OP_G91:
+        lines.append(opcode_name(OP_G91))
+    if pen:
+        lines.append(f"M300 S{PEN_DOWN_S}")
+    return lines
+
+
+def program_fingerprint(program):
+    """Huella del programa que se envía: cambia con el archivo y con el procesado"""
+    if not isinstance(program, GCodeProgram):
+        # Archivo leído bajo demanda: se envía tal cual, basta con su tamaño y fecha
+        stat = os.stat(program.filename)
+        return f"{stat.st_size}-{stat.st_mtime_ns}"
+    digest = hashlib.sha256(program.data.tobytes())
+    if program.emit is not None:
+        digest.update(program.emit.tobytes())
+    for row in sorted(program.raw):
+        digest.update(f"{row}:{program.raw[row]}\n".encode())
+    digest.update(str(program.decimals).encode())
+    return digest.hexdigest()
+
+
+def checkpoint_path(directory, filename):
+    """Archivo del punto de reanudación de un archivo G-code"""
+    name = hashlib.sha256(os.path.abspath(filename).encode()).hexdigest()[:32]
+    return os.path.join(directory, name + '.json')
+
+
+def save_checkpoint(path, checkpoint):
+    """Guarda un punto de reanudación sin dejar nunca un archivo a medias"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomic_write(path, lambda f: json.dump(dict(checkpoint, version=CHECKPOINT_VERSION), f),
+                 binary=False)
+
+
+def load_checkpoint(path):
+    """Punto de reanudación guardado, o None si no hay o no se puede leer"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(checkpoint, dict) or checkpoint.get('version') != CHECKPOINT_VERSION:
+        return None
+    return checkpoint
+
+
+def remove_checkpoint(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,144 @@
+"""Telemetría del envío de G-code: marcas de tiempo por línea y estadísticas.
+
+El controlador anota con el reloj monotónico (time.perf_counter) cuándo
+envía cada línea del programa y cuándo llega su "ok"; como el firmware
+contesta en orden, el k-ésimo "ok" corresponde a la k-ésima línea enviada.
+Con eso se calculan la latencia hasta el "ok", los huecos entre líneas, el
+ritmo, el uso del enlace serie y el tiempo restante, y se puede exportar la
+traza completa a CSV o JSON.
+"""
+import bisect
+import csv
+import json
+import threading
+import time
+
+import numpy as np
+
+# Ventana (s) para el ritmo y el uso del enlace "actuales"
+RATE_WINDOW = 5.0
+
+TRACE_FIELDS = ('index', 'bytes', 'sent', 'acked', 'latency', 'gap')
+
+
+class StreamTelemetry:
+    """Marcas de tiempo de las líneas de un streaming"""
+
+    def __init__(self, baud=9600):
+        self.baud = baud
+        self._lock = threading.Lock()
+        self.start()
+
+    def start(self):
+        """Empieza una traza nueva"""
+        with self._lock:
+            self.started = time.perf_counter()
+            self._index = []      # Índice en el programa de cada línea enviada
+            self._bytes = []      # Bytes enviados (con el \n)
+            self._sent = []       # Instante del envío
+            self._acked = []      # Instante del "ok", en el mismo orden
+            self._sent_bytes = [0]  # Bytes enviados acumulados tras cada línea
+            self.received_bytes = 0
+            self.sleep_time = 0.0  # Tiempo en esperas fijas del host
+
+    def sent(self, index, nbytes, now=None):
+        """Anota el envío de una línea del programa"""
+        now = time.perf_counter() if now is None else now
+        with self._lock:
+            self._index.append(index)
+            self._bytes.append(nbytes)
+            self._sent.append(now)
+            self._sent_bytes.append(self._sent_bytes[-1] + nbytes)
+
+    def acked(self, now=None):
+        """Anota un "ok" (de la línea más antigua pendiente)"""
+        now = time.perf_counter() if now is None else now
+        with self._lock:
+            if len(self._acked) < len(self._sent):
+                self._acked.append(now)
+
+    def received(self, nbytes):
+        self.received_bytes += nbytes
+
+    def slept(self, seconds):
+        self.sleep_time += seconds
+
+    @property
+    def lines_acked(self):
+        return len(self._acked)
+
+    def stats(self, total_lines=None, now=None):
+        """Resumen: ritmo, latencias, uso del enlace y tiempo restante"""
+        now = time.perf_counter() if now is None else now
+        with self._lock:
+            acked = np.array(self._acked)
+            sent = np.array(self._sent[:len(acked)])
+            sent_count = len(self._sent)
+            tx_total = self._sent_bytes[-1]
+            # Líneas y bytes de la ventana reciente
+            window_start = max(now - RATE_WINDOW, self.started)
+            recent_acks = len(self._acked) - bisect.bisect_left(self._acked, window_start)
+            first_recent = bisect.bisect_left(self._sent, window_start)
+            tx_recent = tx_total - self._sent_bytes[first_recent]
+        window = max(now - window_start, 1e-9)
+        elapsed = max(now - self.started, 1e-9)
+        latency = acked - sent
+        rate = recent_acks / window
+        result = {
+            'elapsed': elapsed,
+            'lines_sent': sent_count,
+            'lines_acked': len(acked),
+            'lines_per_s': rate,
+            'latency_p50': float(np.percentile(latency, 50)) if len(latency) else None,
+            'latency_p99': float(np.percentile(latency, 99)) if len(latency) else None,
+            'bytes_sent': tx_total,
+            'bytes_received': self.received_bytes,
+            'bytes_per_s': tx_recent / window,
+            # 8N1: 10 bits por byte
+            'link_utilisation': min(tx_recent * 10.0 / self.baud / window, 1.0),
+            'sleep_time': self.sleep_time,
+            'eta': None,
+        }
+        if total_lines is not None and rate > 0:
+            result['eta'] = max(total_lines - len(acked), 0) / rate
+        return result
+
+    def trace(self):
+        """Traza por línea: índice, bytes, envío y "ok" (s desde el inicio), latencia y hueco
+
+        El hueco es el tiempo entre el "ok" de la línea anterior y el envío de
+        esta; 0 si se envió antes (buffer del firmware ocupado).
+        """
+        with self._lock:
+            index = list(self._index)
+            nbytes = list(self._bytes)
+            sent = list(self._sent)
+            acked = list(self._acked)
+        rows = []
+        previous_ack = None
+        for i, (line, size, t_sent) in enumerate(zip(index, nbytes, sent)):
+            t_ack = acked[i] if i < len(acked) else None
+            gap = max(t_sent - previous_ack, 0.0) if previous_ack is not None else 0.0
+            rows.append({
+                'index': line,
+                'bytes': size,
+                'sent': t_sent - self.started,
+                'acked': t_ack - self.started if t_ack is not None else None,
+                'latency': t_ack - t_sent if t_ack is not None else None,
+                'gap': gap,
+            })
+            previous_ack = t_ack
+        return rows
+
+    def export(self, filename, total_lines=None):
+        """Guarda la traza en CSV o, si el nombre acaba en .json, en JSON con el resumen"""
+        rows = self.trace()
+        if filename.lower().endswith('.json'):
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump({'summary': self.stats(total_lines), 'lines': rows}, f)
+        else:
+            with open(filename, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=TRACE_FIELDS)
+                writer.writeheader()
+                writer.writerows(rows)
+        return len(rows)
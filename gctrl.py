@@ -1,251 +1,185 @@
-import serial
-import threading
-import time
-import platform
-import os
-import glob
 import tkinter as tk
 from tkinter import ttk, filedialog, scrolledtext
-from tkinter import messagebox
+from tkinter import font as tkfont
+from tkinter import messagebox, simpledialog
+import os
+from collections import deque
 
-class GCodeController:
-    def __init__(self):
-        self.port = None
-        self.port_name = None
-        self.running = True
-        self.streaming = False
-        self.paused = False
-        self.gcode = []
-        self.gcode_index = 0
-        self.current_line = ""
-        self.log_callback = None  # Callback para logging
-        self.position = {'x': 0, 'y': 0, 'z': 0}  # Posición actual
-        self.machine_limits = {'x': 0, 'y': 0, 'z': 0}  # Límites de la máquina
-        
-    def set_log_callback(self, callback):
-        self.log_callback = callback
-        
-    def log(self, message):
-        if self.log_callback:
-            self.log_callback(message)
-        
-    def find_serial_ports(self):
-        """Encuentra puertos seriales disponibles"""
-        ports = []
-        system = platform.system().lower()
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+from matplotlib.figure import Figure
+
+from gcode_cache import ProgramCache, default_cache_dir
+from gcode_controller import GCodeController, PortWatcher, STREAM_MODES
+from gcode_estimate import format_duration
+from gcode_program import GCodeProgram, PEN_DOWN_S, PEN_UP_S
+from gcode_preview import ToolpathPreview
+
+# Cada cuánto se actualiza la línea en ejecución en el listado de G-code
+LISTING_REFRESH_MS = 200
+
+# Cada cuánto se actualiza el panel de estadísticas durante el streaming
+STATS_REFRESH_MS = 500
+
+# Área de comunicación serie: cada cuánto se vuelcan los mensajes y cuántas líneas se conservan
+LOG_FLUSH_MS = 100
+LOG_MAX_LINES = 5000
+
+# Control manual: mm por pulsación y mm/s al mantener pulsado, según la velocidad elegida
+JOG_STEPS = {"1": 0.1, "2": 1.0, "3": 5.0}
+JOG_RATES = {"1": 1.0, "2": 5.0, "3": 20.0}
+JOG_HOLD_MS = 300    # Pulsación más larga que esto: movimiento continuo
+JOG_REPEAT_MS = 50   # Cada cuánto se pide más recorrido mientras se mantiene pulsado
+JOG_DIRECTIONS = {'x+': (1, 0), 'x-': (-1, 0), 'y+': (0, 1), 'y-': (0, -1)}
+JOG_KEYS = {'Right': 'x+', 'Left': 'x-', 'Up': 'y+', 'Down': 'y-'}
+# Widgets en los que las flechas mueven el cursor y no la máquina
+TEXT_WIDGETS = ('Entry', 'TEntry', 'TSpinbox', 'TCombobox', 'Text')
+
+class GCodeListView(ttk.Frame):
+    """Listado de G-code virtualizado: solo se dibujan las líneas visibles.
+
+    Abrir un programa cuesta lo mismo sea cual sea su longitud; la barra de
+    desplazamiento trabaja con índices del programa y no con el texto.
+    """
+    def __init__(self, parent, width=40, height=20):
+        super().__init__(parent)
+        self.program = []
+        self.top = 0          # Primera línea visible
+        self.rows = height    # Líneas que caben en el área
+        self.current = None   # Línea en ejecución resaltada
+        self.follow = tk.BooleanVar(value=True)
+        self._shown = None
         
-        if "windows" in system:
-            for i in range(1, 21):
-                try:
-                    port = f"COM{i}"
-                    test_serial = serial.Serial(port, 9600, timeout=0.1)
-                    test_serial.close()
-                    ports.append(port)
-                except:
-                    pass
-        else:
-            patterns = ['/dev/ttyUSB*', '/dev/ttyACM*', '/dev/tty.usb*', '/dev/cu.usb*']
-            for pattern in patterns:
-                for port in glob.glob(pattern):
-                    try:
-                        test_serial = serial.Serial(port, 9600, timeout=0.1)
-                        test_serial.close()
-                        ports.append(port)
-                    except:
-                        pass
+        self.text = tk.Text(self, width=width, height=height, wrap=tk.NONE)
+        self.text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.text.tag_configure("current", background="#ffe08a")
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self.scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        ttk.Checkbutton(self, text="Seguir línea en ejecución", variable=self.follow).grid(
+            row=1, column=0, sticky=tk.W, pady=(5, 0))
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
         
-        return ports
+        self.text.bind("<Configure>", self.on_resize)
+        self.text.bind("<MouseWheel>", lambda e: self.scroll(-3 if e.delta > 0 else 3))
+        self.text.bind("<Button-4>", lambda e: self.scroll(-3))
+        self.text.bind("<Button-5>", lambda e: self.scroll(3))
     
-    def connect(self, port_name):
-        """Conecta al puerto serial"""
-        if not port_name:
-            return False
-        
-        try:
-            if self.port:
-                self.port.close()
-            
-            self.port = serial.Serial(port_name, 9600, timeout=1)
-            self.port_name = port_name
-            
-            # Iniciar hilo de lectura
-            read_thread = threading.Thread(target=self.read_responses, daemon=True)
-            read_thread.start()
-            
-            return True
-        except Exception as e:
-            messagebox.showerror("Error", f"Error conectando a {port_name}: {e}")
-            return False
+    def set_program(self, program):
+        """Muestra un programa nuevo (tiempo constante)"""
+        self.program = program
+        self.top = 0
+        self.current = None
+        self.render(force=True)
     
-    def send_command(self, command):
-        """Envía un comando al puerto serial"""
-        if self.port and self.port.is_open:
-            try:
-                # Asegurar que el comando termina con \n
-                if not command.endswith('\n'):
-                    command = command + '\n'
-                # Enviar el comando como bytes
-                self.port.write(command.encode())
-                self.current_line = command.strip()
-                self.log(f"→ {self.current_line}")
-                # Esperar un momento para asegurar que el Arduino procesa el comando
-                time.sleep(0.1)
-                return True
-            except Exception as e:
-                self.log(f"Error enviando comando: {e}")
-                return False
-        return False
+    def on_resize(self, event):
+        linespace = tkfont.Font(font=self.text['font']).metrics('linespace')
+        self.rows = max(event.height // max(linespace, 1), 1)
+        self.render(force=True)
     
-    def read_responses(self):
-        """Lee respuestas del puerto serial"""
-        while self.running and self.port and self.port.is_open:
-            try:
-                if self.port.in_waiting > 0:
-                    response = self.port.readline().decode().strip()
-                    if response:
-                        self.log(f"← {response}")
-                        # Procesar respuesta de estado
-                        if response.startswith("<"):
-                            # Ejemplo: <Idle|MPos:0.000,0.000,0.000|FS:0,0>
-                            try:
-                                pos_str = response.split("MPos:")[1].split("|")[0]
-                                x, y, z = map(float, pos_str.split(","))
-                                self.position = {'x': x, 'y': y, 'z': z}
-                            except:
-                                pass
-                        elif response.startswith("ok"):
-                            if self.streaming and not self.paused:
-                                time.sleep(0.1)
-                                self.send_next_gcode_line()
-                        elif response.startswith("error"):
-                            self.log(f"Error en comando: {self.current_line}")
-            except Exception as e:
-                self.log(f"Error leyendo respuesta: {e}")
-                break
-            time.sleep(0.01)
+    def scroll(self, lines):
+        self.follow.set(False)
+        self.top += lines
+        self.render()
+        return "break"
     
-    def load_gcode(self, filename):
-        """Carga archivo G-code"""
-        try:
-            with open(filename, 'r') as f:
-                lines = f.readlines()
-            
-            # Filtrar líneas vacías y comentarios
-            self.gcode = []
-            current_x, current_y = 0, 0
-            
-            for line in lines:
-                line = line.strip()
-                if line and not line.startswith(';') and not line.startswith('('):
-                    self.gcode.append(line)
-                    # Procesar coordenadas para la trayectoria
-                    if 'X' in line or 'Y' in line:
-                        try:
-                            # Extraer coordenadas X e Y
-                            x = current_x
-                            y = current_y
-                            if 'X' in line:
-                                x = float(line[line.find('X')+1:].split()[0])
-                            if 'Y' in line:
-                                y = float(line[line.find('Y')+1:].split()[0])
-                            current_x, current_y = x, y
-                        except:
-                            pass
-            
-            return True
-        except Exception as e:
-            messagebox.showerror("Error", f"Error cargando archivo: {e}")
-            return False
+    def yview(self, *args):
+        """Comando de la barra de desplazamiento"""
+        total = len(self.program)
+        if args[0] == "moveto":
+            self.top = int(float(args[1]) * total)
+        elif args[0] == "scroll":
+            amount = int(args[1]) * (self.rows if args[2] == "pages" else 1)
+            self.top += amount
+        self.follow.set(False)
+        self.render()
     
-    def send_next_gcode_line(self):
-        """Envía la siguiente línea de G-code"""
-        if self.gcode_index < len(self.gcode):
-            line = self.gcode[self.gcode_index]
-            if self.send_command(line):
-                self.gcode_index += 1
-                return True
-        else:
-            self.streaming = False
-            messagebox.showinfo("Completado", "G-code ejecutado completamente")
-        return False
+    def set_current(self, index):
+        """Resalta la línea en ejecución y, si está activado, la sigue"""
+        self.current = index
+        if self.follow.get() and index is not None and not self.top <= index < self.top + self.rows:
+            self.top = index - self.rows // 3
+        self.render()
     
-    def start_streaming(self):
-        """Inicia el streaming de G-code"""
-        if not self.gcode:
-            messagebox.showwarning("Advertencia", "No hay G-code cargado")
+    def render(self, force=False):
+        """Dibuja la ventana visible si algo ha cambiado"""
+        total = len(self.program)
+        self.top = max(min(self.top, total - self.rows), 0)
+        state = (self.top, self.rows, self.current, total)
+        if state == self._shown and not force:
             return
-        
-        if not self.streaming:
-            self.streaming = True
-            self.paused = False
-            self.gcode_index = 0
-            self.send_next_gcode_line()
-    
-    def pause_streaming(self):
-        """Pausa el streaming"""
-        self.paused = True
-    
-    def resume_streaming(self):
-        """Reanuda el streaming"""
-        self.paused = False
-        if self.streaming:
-            self.send_next_gcode_line()
-    
-    def stop_streaming(self):
-        """Detiene el streaming"""
-        self.streaming = False
-        self.paused = False
-        self.gcode_index = 0
-    
-    def emergency_stop(self):
-        """Parada de emergencia"""
-        if self.port and self.port.is_open:
-            self.port.write(b'\x18')  # Ctrl+X
-            self.stop_streaming()
-    
-    def disconnect(self):
-        """Desconecta el puerto serial"""
-        self.running = False
-        if self.port and self.port.is_open:
-            self.port.close()
-    
-    def get_status(self):
-        """Obtiene el estado actual de la máquina"""
-        self.send_command("?")
+        self._shown = state
+        end = min(self.top + self.rows, total)
+        lines = [f"{i + 1:6d}: {self.program[i]}" for i in range(self.top, end)]
+        self.text.delete("1.0", tk.END)
+        self.text.insert("1.0", "\n".join(lines))
+        if self.current is not None and self.top <= self.current < end:
+            row = self.current - self.top + 1
+            self.text.tag_add("current", f"{row}.0", f"{row + 1}.0")
+        if total:
+            self.scrollbar.set(self.top / total, end / total)
+        else:
+            self.scrollbar.set(0, 1)
+
+class ToolpathView(ttk.Frame):
+    """Vista previa del recorrido (matplotlib) con su barra de zoom y desplazamiento"""
+    def __init__(self, parent, width=5, height=5):
+        super().__init__(parent)
+        figure = Figure(figsize=(width, height), dpi=100, tight_layout=True)
+        self.canvas = FigureCanvasTkAgg(figure, master=self)
+        self.preview = ToolpathPreview(figure)
+        self.canvas.get_tk_widget().grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        toolbar_frame = ttk.Frame(self)
+        toolbar_frame.grid(row=1, column=0, sticky=(tk.W, tk.E))
+        self.toolbar = NavigationToolbar2Tk(self.canvas, toolbar_frame, pack_toolbar=False)
+        self.toolbar.update()
+        self.toolbar.pack(side=tk.LEFT)
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
     
-    def set_origin(self):
-        """Establece la posición actual como origen"""
-        self.send_command("G92X0Y0Z0")
-        self.position = {'x': 0, 'y': 0, 'z': 0}
+    def set_program(self, program):
+        """Muestra el recorrido; los archivos leídos bajo demanda no tienen vista previa"""
+        self.preview.set_program(program if isinstance(program, GCodeProgram) else None)
     
-    def test_limits(self):
-        """Prueba los límites de la máquina"""
-        # Secuencia de prueba
-        commands = [
-            "G90",  # Modo absoluto
-            "G0X0Y0Z0",  # Ir a origen
-            "G0X10",  # Mover X
-            "G0X0",   # Volver
-            "G0Y10",  # Mover Y
-            "G0Y0",   # Volver
-            "G0Z10",  # Mover Z
-            "G0Z0"    # Volver
-        ]
-        for cmd in commands:
-            self.send_command(cmd)
-            time.sleep(0.5)  # Esperar entre movimientos
+    def set_progress(self, index):
+        self.preview.set_progress(index)
 
 class GCodeGUI:
-    def __init__(self, root):
+    def __init__(self, root, log_max_lines=LOG_MAX_LINES):
         self.root = root
         self.root.title("Controlador G-code by 'Paradoja Developers'")
+        # Los mensajes llegan también desde el hilo de lectura: se encolan y
+        # solo el hilo de Tk los vuelca al área de texto
+        self.log_queue = deque()
+        self.log_max_lines = log_max_lines
+        self.log_lines = 0
+        self.log_file = None
+        # Igual con los avisos y el final del programa: se ejecutan en el hilo de Tk
+        self.ui_calls = deque()
+        self.jog_direction = None  # Movimiento continuo en curso ('x+', 'y-'...)
+        self.jog_timer = None
+        self.jog_release = None
         self.controller = GCodeController()
         self.controller.set_log_callback(self.log)
+        self.controller.set_alert_callback(
+            lambda level, title, message: self.call_in_ui(self.show_alert, level, title, message))
+        self.controller.set_finished_callback(lambda: self.call_in_ui(self.streaming_finished))
+        try:
+            self.controller.cache = ProgramCache()
+        except OSError as e:
+            self.log(f"Caché de programas desactivada: {e}")
+        # Puntos de reanudación guardados periódicamente durante el envío
+        self.controller.checkpoint_dir = os.path.join(default_cache_dir(), "checkpoints")
+        # La lista de puertos se mantiene en segundo plano, sin abrir ninguno
+        self.port_watcher = PortWatcher(callback=lambda ports: self.call_in_ui(self.set_ports, ports))
         
         self.create_widgets()
-        self.update_ports()
+        self.port_watcher.start()
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.update_position()
+        self.update_listing()
+        self.update_stats()
+        self.flush_log()
+        self.run_ui_calls()
     
     def create_widgets(self):
         # Frame principal
@@ -267,7 +201,8 @@ class GCodeGUI:
         ttk.Button(top_frame, text="Actualizar", command=self.update_ports).grid(row=0, column=2, padx=5)
         self.connect_btn = ttk.Button(top_frame, text="Conectar", command=self.toggle_connection)
         self.connect_btn.grid(row=0, column=3, padx=5)
-        ttk.Button(top_frame, text="Abrir G-code", command=self.open_file).grid(row=0, column=4, padx=5)
+        self.open_btn = ttk.Button(top_frame, text="Abrir G-code", command=self.open_file)
+        self.open_btn.grid(row=0, column=4, padx=5)
         
         # Frame central para áreas de texto
         text_frame = ttk.Frame(left_frame, padding="5")
@@ -275,13 +210,22 @@ class GCodeGUI:
         
         gcode_frame = ttk.LabelFrame(text_frame, text="G-code", padding="5")
         gcode_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-        self.gcode_area = scrolledtext.ScrolledText(gcode_frame, width=40, height=20)
-        self.gcode_area.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.gcode_view = GCodeListView(gcode_frame, width=40, height=20)
+        self.gcode_view.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         
         serial_frame = ttk.LabelFrame(text_frame, text="Comunicación Serial", padding="5")
         serial_frame.grid(row=0, column=1, sticky=(tk.W, tk.E, tk.N, tk.S))
         self.serial_area = scrolledtext.ScrolledText(serial_frame, width=40, height=20)
         self.serial_area.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.log_file_btn = ttk.Button(serial_frame, text="Guardar log...", command=self.toggle_log_file)
+        self.log_file_btn.grid(row=1, column=0, sticky=tk.E, pady=(5, 0))
+        
+        preview_frame = ttk.LabelFrame(main_frame, text="Vista previa", padding="5")
+        preview_frame.grid(row=0, column=1, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.toolpath_view = ToolpathView(preview_frame)
+        self.toolpath_view.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        preview_frame.columnconfigure(0, weight=1)
+        preview_frame.rowconfigure(0, weight=1)
         
         position_frame = ttk.LabelFrame(left_frame, text="Posición Actual", padding="5")
         position_frame.grid(row=2, column=0, sticky=(tk.W, tk.E))
@@ -301,10 +245,16 @@ class GCodeGUI:
         manual_frame = ttk.LabelFrame(left_frame, text="Control Manual", padding="5")
         manual_frame.grid(row=3, column=0, sticky=(tk.W, tk.E))
         ttk.Button(manual_frame, text="Origen", command=self.home).grid(row=0, column=0, padx=5)
-        ttk.Button(manual_frame, text="Motor X +", command=lambda: self.jog('x+')).grid(row=0, column=1, padx=5)
-        ttk.Button(manual_frame, text="Motor X -", command=lambda: self.jog('x-')).grid(row=0, column=2, padx=5)
-        ttk.Button(manual_frame, text="Motor Y +", command=lambda: self.jog('y+')).grid(row=0, column=3, padx=5)
-        ttk.Button(manual_frame, text="Motor Y -", command=lambda: self.jog('y-')).grid(row=0, column=4, padx=5)
+        # Los motores se mueven mientras se mantiene pulsado el botón (o las flechas del teclado)
+        for column, (text, direction) in enumerate((("Motor X +", 'x+'), ("Motor X -", 'x-'),
+                                                    ("Motor Y +", 'y+'), ("Motor Y -", 'y-')), 1):
+            button = ttk.Button(manual_frame, text=text)
+            button.grid(row=0, column=column, padx=5)
+            button.bind("<ButtonPress-1>", lambda e, d=direction: self.start_jog(d))
+            button.bind("<ButtonRelease-1>", self.stop_jog)
+        for key, direction in JOG_KEYS.items():
+            self.root.bind(f"<KeyPress-{key}>", lambda e, d=direction: self.jog_key(e, d))
+            self.root.bind(f"<KeyRelease-{key}>", lambda e: self.jog_key(e, None))
         ttk.Button(manual_frame, text="Servo +", command=lambda: self.jog('z+')).grid(row=0, column=5, padx=5)
         ttk.Button(manual_frame, text="Servo -", command=lambda: self.jog('z-')).grid(row=0, column=6, padx=5)
         
@@ -319,24 +269,63 @@ class GCodeGUI:
         control_frame.grid(row=5, column=0, sticky=(tk.W, tk.E))
         self.start_btn = ttk.Button(control_frame, text="Iniciar", command=self.start_streaming, state=tk.DISABLED)
         self.start_btn.grid(row=0, column=0, padx=5)
+        self.resume_btn = ttk.Button(control_frame, text="Reanudar desde...", command=self.resume_from_line, state=tk.DISABLED)
+        self.resume_btn.grid(row=0, column=1, padx=5)
         self.pause_btn = ttk.Button(control_frame, text="Pausar", command=self.pause_streaming, state=tk.DISABLED)
-        self.pause_btn.grid(row=0, column=1, padx=5)
+        self.pause_btn.grid(row=0, column=2, padx=5)
         self.stop_btn = ttk.Button(control_frame, text="Detener", command=self.stop_streaming, state=tk.DISABLED)
-        self.stop_btn.grid(row=0, column=2, padx=5)
+        self.stop_btn.grid(row=0, column=3, padx=5)
         self.emergency_btn = ttk.Button(control_frame, text="¡EMERGENCIA!", command=self.emergency_stop, state=tk.DISABLED)
-        self.emergency_btn.grid(row=0, column=3, padx=5)
+        self.emergency_btn.grid(row=0, column=4, padx=5)
+        ttk.Label(control_frame, text="Protocolo:").grid(row=0, column=5, padx=5)
+        self.stream_mode_var = tk.StringVar(value=self.controller.stream_mode)
+        self.stream_mode_combo = ttk.Combobox(control_frame, textvariable=self.stream_mode_var,
+                                              values=STREAM_MODES, state="readonly", width=12)
+        self.stream_mode_combo.grid(row=0, column=6, padx=5)
+        self.stream_mode_combo.bind("<<ComboboxSelected>>", self.change_stream_mode)
+        
+        process_frame = ttk.LabelFrame(left_frame, text="Procesado al cargar", padding="5")
+        process_frame.grid(row=6, column=0, sticky=(tk.W, tk.E))
+        self.reorder_var = tk.BooleanVar(value=self.controller.reorder_polylines)
+        ttk.Checkbutton(process_frame, text="Optimizar recorridos", variable=self.reorder_var).grid(row=0, column=0, padx=5)
+        self.simplify_var = tk.BooleanVar(value=self.controller.simplify_tolerance is not None)
+        ttk.Checkbutton(process_frame, text="Simplificar trazos", variable=self.simplify_var).grid(row=0, column=1, padx=5)
+        ttk.Label(process_frame, text="Tolerancia (mm):").grid(row=0, column=2, padx=5)
+        self.tolerance_var = tk.StringVar(value="0.05")
+        ttk.Spinbox(process_frame, textvariable=self.tolerance_var, from_=0, to=5,
+                    increment=0.01, width=6).grid(row=0, column=3, padx=5)
+        self.compact_var = tk.BooleanVar(value=self.controller.compact_wire)
+        ttk.Checkbutton(process_frame, text="Compactar comandos", variable=self.compact_var).grid(row=0, column=4, padx=5)
+        
+        stats_frame = ttk.LabelFrame(left_frame, text="Estadísticas", padding="5")
+        stats_frame.grid(row=7, column=0, sticky=(tk.W, tk.E))
+        self.stats_labels = {}
+        for column, (key, title) in enumerate((("rate", "Líneas/s:"), ("latency", "Latencia p50/p99:"),
+                                               ("link", "Uso del enlace:"), ("eta", "Tiempo restante:"))):
+            ttk.Label(stats_frame, text=title).grid(row=0, column=2 * column, padx=5)
+            self.stats_labels[key] = ttk.Label(stats_frame, text="-")
+            self.stats_labels[key].grid(row=0, column=2 * column + 1, padx=5)
+        ttk.Button(stats_frame, text="Exportar traza...", command=self.export_trace).grid(row=0, column=8, padx=5)
         
         self.root.columnconfigure(0, weight=1)
         self.root.rowconfigure(0, weight=1)
         main_frame.columnconfigure(0, weight=1)
+        main_frame.columnconfigure(1, weight=1)
         main_frame.rowconfigure(0, weight=1)
     
     def update_ports(self):
-        """Actualiza la lista de puertos disponibles"""
-        ports = self.controller.find_serial_ports()
+        """Actualiza la lista de puertos disponibles (sin bloquear la interfaz)"""
+        self.port_watcher.refresh()
+    
+    def set_ports(self, ports):
+        """Muestra la lista de puertos; conserva el seleccionado si sigue presente"""
         self.port_combo['values'] = ports
-        if ports:
-            self.port_combo.set(ports[0])
+        if self.port_var.get() not in ports:
+            connected = self.controller.port and self.controller.port.is_open
+            if connected:
+                self.log(f"El puerto {self.controller.port_name} ya no está disponible")
+            else:
+                self.port_combo.set(ports[0] if ports else "")
     
     def toggle_connection(self):
         """Conecta/desconecta el puerto serial"""
@@ -344,13 +333,18 @@ class GCodeGUI:
             if self.controller.connect(self.port_var.get()):
                 self.connect_btn.configure(text="Desconectar")
                 self.start_btn.configure(state=tk.NORMAL)
+                self.resume_btn.configure(state=tk.NORMAL)
                 self.emergency_btn.configure(state=tk.NORMAL)
                 self.log("Conectado a " + self.controller.port_name)
         else:
+            if self.controller.streaming:
+                self.controller.stop_streaming()  # Sin puerto no puede continuar; se guarda el punto de reanudación
             self.controller.disconnect()
             self.connect_btn.configure(text="Conectar")
             self.start_btn.configure(state=tk.DISABLED)
+            self.resume_btn.configure(state=tk.DISABLED)
             self.pause_btn.configure(state=tk.DISABLED)
+            self.open_btn.configure(state=tk.NORMAL)
             self.stop_btn.configure(state=tk.DISABLED)
             self.emergency_btn.configure(state=tk.DISABLED)
             self.log("Desconectado")
@@ -362,22 +356,68 @@ class GCodeGUI:
             filetypes=[("G-code files", "*.gcode *.nc *.g"), ("All files", "*.*")]
         )
         if filename:
+            self.controller.reorder_polylines = self.reorder_var.get()
+            self.controller.compact_wire = self.compact_var.get()
+            self.controller.simplify_tolerance = None
+            if self.simplify_var.get():
+                try:
+                    self.controller.simplify_tolerance = max(float(self.tolerance_var.get()), 0.0)
+                except ValueError:
+                    messagebox.showerror("Error", "Tolerancia de simplificación no válida")
+                    return
             if self.controller.load_gcode(filename):
                 self.log(f"Archivo cargado: {filename}")
-                # Mostrar contenido del G-code
-                self.gcode_area.delete(1.0, tk.END)
-                for i, line in enumerate(self.controller.gcode, 1):
-                    self.gcode_area.insert(tk.END, f"{i:4d}: {line}\n")
+                job = self.controller.estimate_job()
+                if job:
+                    phases = job['phases']
+                    self.log(f"Tiempo estimado ({self.controller.stream_mode}): "
+                             f"{format_duration(job['total'])} (dibujo {phases['draw']:.0f} s, "
+                             f"vacío {phases['travel']:.0f} s, pluma {phases['pen']:.0f} s, "
+                             f"serie {phases['serial']:.0f} s); "
+                             f"{job['draw_distance']:.0f} mm dibujados, "
+                             f"{job['travel_distance']:.0f} mm en vacío")
+                # Mostrar contenido del G-code y su recorrido
+                self.gcode_view.set_program(self.controller.gcode)
+                self.toolpath_view.set_program(self.controller.gcode)
                 self.start_btn.configure(state=tk.NORMAL)
+                self.resume_btn.configure(state=tk.NORMAL)
+                checkpoint = self.controller.load_checkpoint()
+                if checkpoint:
+                    self.log(f"Hay un punto de reanudación en la línea {checkpoint['index'] + 1} "
+                             f"de {checkpoint['lines']}: usar \"Reanudar desde...\" para continuar")
     
-    def start_streaming(self):
+    def change_stream_mode(self, event=None):
+        """Cambia el protocolo de envío"""
+        if self.controller.set_stream_mode(self.stream_mode_var.get()):
+            self.log(f"Protocolo de envío: {self.controller.stream_mode}")
+        else:
+            self.stream_mode_var.set(self.controller.stream_mode)
+    
+    def start_streaming(self, start=0):
         """Inicia el streaming de G-code"""
-        self.controller.start_streaming()
+        if not self.controller.start_streaming(start):
+            return
         self.start_btn.configure(state=tk.DISABLED)
+        self.resume_btn.configure(state=tk.DISABLED)
+        self.open_btn.configure(state=tk.DISABLED)
         self.pause_btn.configure(state=tk.NORMAL)
         self.stop_btn.configure(state=tk.NORMAL)
         self.log("Iniciando ejecución")
     
+    def resume_from_line(self):
+        """Pide la línea desde la que continuar (por defecto, la del punto de reanudación)"""
+        checkpoint = self.controller.load_checkpoint()
+        if checkpoint:
+            line = checkpoint['index'] + 1
+        else:
+            line = self.controller.acked_index + 1
+        total = len(self.controller.gcode)
+        line = simpledialog.askinteger(
+            "Reanudar", f"Línea desde la que continuar (1-{total}):",
+            initialvalue=min(line, total), minvalue=1, maxvalue=total, parent=self.root)
+        if line:
+            self.start_streaming(line - 1)
+    
     def pause_streaming(self):
         """Pausa/reanuda el streaming"""
         if not self.controller.paused:
@@ -393,7 +433,9 @@ class GCodeGUI:
         """Detiene el streaming"""
         self.controller.stop_streaming()
         self.start_btn.configure(state=tk.NORMAL)
+        self.resume_btn.configure(state=tk.NORMAL)
         self.pause_btn.configure(state=tk.DISABLED)
+        self.open_btn.configure(state=tk.NORMAL)
         self.stop_btn.configure(state=tk.DISABLED)
         self.log("Detenido")
     
@@ -401,43 +443,170 @@ class GCodeGUI:
         """Parada de emergencia"""
         self.controller.emergency_stop()
         self.start_btn.configure(state=tk.NORMAL)
+        self.resume_btn.configure(state=tk.NORMAL)
         self.pause_btn.configure(state=tk.DISABLED)
+        self.open_btn.configure(state=tk.NORMAL)
         self.stop_btn.configure(state=tk.DISABLED)
         self.log("¡PARADA DE EMERGENCIA!")
     
+    def streaming_finished(self):
+        """El controlador ha terminado de ejecutar el programa"""
+        self.show_stats()
+        self.toolpath_view.set_progress(len(self.controller.gcode))
+        self.start_btn.configure(state=tk.NORMAL)
+        self.resume_btn.configure(state=tk.NORMAL)
+        self.pause_btn.configure(state=tk.DISABLED, text="Pausar")
+        self.open_btn.configure(state=tk.NORMAL)
+        self.stop_btn.configure(state=tk.DISABLED)
+        messagebox.showinfo("Completado", "G-code ejecutado completamente")
+    
+    def show_alert(self, level, title, message):
+        """Muestra un aviso del controlador"""
+        show = {"error": messagebox.showerror, "warning": messagebox.showwarning}.get(
+            level, messagebox.showinfo)
+        show(title, message)
+    
+    def call_in_ui(self, func, *args):
+        """Encola una llamada para el hilo de Tk (se puede llamar desde cualquier hilo)"""
+        self.ui_calls.append((func, args))
+    
+    def run_ui_calls(self):
+        """Ejecuta las llamadas encoladas desde otros hilos"""
+        try:
+            while True:
+                func, args = self.ui_calls.popleft()
+                func(*args)
+        except IndexError:
+            pass
+        self.root.after(LOG_FLUSH_MS, self.run_ui_calls)
+    
     def log(self, message):
-        """Añade mensaje al área de texto"""
-        self.serial_area.insert(tk.END, message + "\n")
-        self.serial_area.see(tk.END)
+        """Encola un mensaje para el área de texto (se puede llamar desde cualquier hilo)"""
+        self.log_queue.append(message)
+    
+    def flush_log(self, reschedule=True):
+        """Vuelca de una vez los mensajes pendientes al área de texto y al archivo de log"""
+        messages = []
+        try:
+            while True:
+                messages.append(self.log_queue.popleft())
+        except IndexError:
+            pass
+        if messages:
+            if self.log_file:
+                self.log_file.write("\n".join(messages) + "\n")
+            # Solo se muestran las últimas log_max_lines líneas
+            text = "\n".join(messages[-self.log_max_lines:]) + "\n"
+            self.serial_area.insert(tk.END, text)
+            self.log_lines += text.count("\n")
+            excess = self.log_lines - self.log_max_lines
+            if excess > 0:
+                self.serial_area.delete("1.0", f"{excess + 1}.0")
+                self.log_lines -= excess
+            self.serial_area.see(tk.END)
+        if reschedule:
+            self.root.after(LOG_FLUSH_MS, self.flush_log)
+    
+    def toggle_log_file(self):
+        """Empieza o termina de guardar el log completo en un archivo"""
+        if self.log_file:
+            self.flush_log(reschedule=False)
+            self.log_file.close()
+            self.log_file = None
+            self.log_file_btn.configure(text="Guardar log...")
+            self.log("Log guardado")
+            return
+        filename = filedialog.asksaveasfilename(
+            title="Guardar log de comunicación",
+            defaultextension=".log",
+            filetypes=[("Log files", "*.log *.txt"), ("All files", "*.*")]
+        )
+        if filename:
+            try:
+                self.log_file = open(filename, 'a', encoding='utf-8', buffering=1024 * 1024)
+            except OSError as e:
+                messagebox.showerror("Error", f"Error abriendo {filename}: {e}")
+                return
+            self.log_file_btn.configure(text="Dejar de guardar log")
+            self.log(f"Guardando log en {filename}")
     
     def on_closing(self):
         """Maneja el cierre de la ventana"""
         if messagebox.askokcancel("Salir", "¿Desea salir?"):
+            self.port_watcher.stop()
             self.controller.disconnect()
+            if self.log_file:
+                self.flush_log(reschedule=False)
+                self.log_file.close()
             self.root.destroy()
 
     def home(self):
         """Mover a posición de origen"""
         if self.controller.port and self.controller.port.is_open:
-            self.controller.send_command("$H")
+            # Las órdenes van en cola: el estado se pide cuando el origen ha terminado
+            self.controller.queue_command("$H")
+            self.controller.get_status()
             self.log("Enviando comando de origen")
-            # Esperar un momento y actualizar posición
-            self.root.after(1000, self.controller.get_status)
 
     def jog(self, direction):
-        """Movimiento manual"""
+        """Movimiento manual de un paso (el servo sube o baja la pluma)"""
         if self.controller.port and self.controller.port.is_open:
-            # Obtener velocidad según selección
-            speed = {
-                "1": "0.001",  # Lenta
-                "2": "0.01",   # Media
-                "3": "0.1"     # Rápida
-            }[self.speed_var.get()]
-            
-            # Enviar comando de movimiento
-            command = f"G91G0{direction.upper()}{speed}"
-            self.controller.send_command(command)
-            self.log(f"Movimiento manual: {direction}")
+            if direction in ('z+', 'z-'):
+                queued = self.controller.queue_command(f"M300 S{PEN_UP_S if direction == 'z+' else PEN_DOWN_S}")
+            else:
+                dx, dy = JOG_DIRECTIONS[direction]
+                step = JOG_STEPS[self.speed_var.get()]
+                queued = self.controller.jog(dx * step, dy * step)
+            if queued:
+                self.log(f"Movimiento manual: {direction}")
+            else:
+                self.log("Movimiento manual no disponible durante la ejecución")
+            return queued
+        return False
+
+    def start_jog(self, direction):
+        """Un paso y, si se mantiene pulsado, movimiento continuo hasta soltar"""
+        if self.jog_release is not None:
+            # La repetición de teclas genera soltar/pulsar seguidos: se sigue moviendo
+            self.root.after_cancel(self.jog_release)
+            self.jog_release = None
+        if direction == self.jog_direction:
+            return
+        self.end_jog()
+        if self.jog(direction):
+            self.jog_direction = direction
+            self.jog_timer = self.root.after(JOG_HOLD_MS, self.continue_jog)
+
+    def continue_jog(self):
+        """Pide más recorrido; el controlador lo suma al movimiento que aún no ha enviado"""
+        if self.jog_direction is None:
+            return
+        dx, dy = JOG_DIRECTIONS[self.jog_direction]
+        step = JOG_RATES[self.speed_var.get()] * JOG_REPEAT_MS / 1000.0
+        if not self.controller.jog(dx * step, dy * step):
+            self.end_jog()
+            return
+        self.jog_timer = self.root.after(JOG_REPEAT_MS, self.continue_jog)
+
+    def stop_jog(self, event=None):
+        if self.jog_direction is not None and self.jog_release is None:
+            self.jog_release = self.root.after(JOG_REPEAT_MS, self.end_jog)
+
+    def end_jog(self):
+        self.jog_release = None
+        if self.jog_timer is not None:
+            self.root.after_cancel(self.jog_timer)
+            self.jog_timer = None
+        self.jog_direction = None
+
+    def jog_key(self, event, direction):
+        """Flechas del teclado: mueven la máquina salvo al escribir en un campo de texto"""
+        if event.widget.winfo_class() in TEXT_WIDGETS:
+            return
+        if direction is None:
+            self.stop_jog()
+        else:
+            self.start_jog(direction)
 
     def update_position(self):
         """Actualiza la posición mostrada en la interfaz"""
@@ -447,6 +616,47 @@ class GCodeGUI:
             self.z_pos_label.configure(text=f"{self.controller.position['z']:.3f}")
         self.root.after(100, self.update_position)  # Actualizar cada 100ms
 
+    def update_listing(self):
+        """Sigue en el listado y en la vista previa la línea en ejecución (y el avance del indexado de archivos grandes)"""
+        if self.controller.streaming:
+            self.gcode_view.set_current(self.controller.executing_index)
+            self.toolpath_view.set_progress(self.controller.executing_index)
+        else:
+            self.gcode_view.render()
+        self.root.after(LISTING_REFRESH_MS, self.update_listing)
+
+    def update_stats(self):
+        """Refresca el panel de estadísticas mientras se envía el programa"""
+        if self.controller.streaming:
+            self.show_stats()
+        self.root.after(STATS_REFRESH_MS, self.update_stats)
+    
+    def show_stats(self):
+        stats = self.controller.telemetry.stats(self.controller.stream_length())
+        self.stats_labels["rate"].configure(text=f"{stats['lines_per_s']:.1f}")
+        if stats['latency_p50'] is not None:
+            self.stats_labels["latency"].configure(
+                text=f"{stats['latency_p50'] * 1000:.0f} / {stats['latency_p99'] * 1000:.0f} ms")
+        self.stats_labels["link"].configure(
+            text=f"{stats['link_utilisation'] * 100:.0f}% ({stats['bytes_per_s']:.0f} B/s)")
+        eta = stats['eta'] if self.controller.streaming else 0
+        self.stats_labels["eta"].configure(text=format_duration(eta) if eta is not None else "-")
+    
+    def export_trace(self):
+        """Guarda la traza de tiempos por línea del último streaming"""
+        filename = filedialog.asksaveasfilename(
+            title="Exportar traza de tiempos",
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("JSON", "*.json"), ("All files", "*.*")]
+        )
+        if filename:
+            try:
+                lines = self.controller.telemetry.export(filename, self.controller.stream_length())
+            except OSError as e:
+                messagebox.showerror("Error", f"Error guardando {filename}: {e}")
+                return
+            self.log(f"Traza de {lines} líneas guardada en {filename}")
+    
     def set_origin(self):
         """Establece la posición actual como origen"""
         if self.controller.port and self.controller.port.is_open:
@@ -456,9 +666,12 @@ class GCodeGUI:
     def test_limits(self):
         """Prueba los límites de la máquina"""
         if self.controller.port and self.controller.port.is_open:
-            self.log("Iniciando prueba de límites...")
-            self.controller.test_limits()
-            self.log("Prueba de límites completada")
+            done = lambda ok: self.log("Prueba de límites completada" if ok
+                                       else "Prueba de límites interrumpida")
+            if self.controller.test_limits(done):
+                self.log("Iniciando prueba de límites...")
+            else:
+                self.log("Prueba de límites no disponible durante la ejecución")
 
 def main():
     root = tk.Tk()